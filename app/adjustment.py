@@ -1,18 +1,67 @@
+import bisect
 import csv, collections
+import cStringIO
+import hashlib
+import heapq
 import logging
 
+import array
 import datetime
+import itertools
 import os
 
+from app import cache
+from app.report import RunReport
+
+
+def format_rows(rows):
+    """Return rows formatted as MMS tab delimited file content."""
+
+    buf = cStringIO.StringIO()
+    csv.writer(buf, dialect=csv.excel, delimiter="\t").writerows(rows)
+    return buf.getvalue()
+
+
+def format_item_rows(items):
+    """Return item rows of a pricing event formatted as MMS file content. Same output as format_rows, but
+    when no field needs csv quoting the rows are joined directly."""
+
+    text = "".join(["\t\t%s\t%s\t%s\r\n" % (item.item_style_code, item.item_color, item.item_price)
+                    for item in items])
+    n = len(items)
+    if '"' in text or text.count('\t') != 4 * n or text.count('\n') != n or text.count('\r') != n:
+        text = format_rows([["", "", item.item_style_code, item.item_color, item.item_price] for item in items])
+    return text
+
+
+class ItemBlock(object):
+    """Item header and item rows of a location group. Formatted once and shared by all pricing events (files)
+    the group's locations are split into."""
+
+    def __init__(self, items):
+        self.items = items
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = format_rows([["D", "Sku", "Style", "Color", "New Price"]]) + format_item_rows(self.items)
+        return self._data
+
 
 class PricingEvent(object):
     """Class that represents an exportable entity which MMS will import from file."""
 
-    def __init__(self, name, headers, locations, items, basedir):
+    WRITE_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, name, headers, locations, items, basedir, header_block=None, item_block=None):
         self.name = name
         self.headers = headers
+        self.header_block = header_block  # headers formatted once for all events of an adjustment
         self.locations = locations
         self.items = items
+        self.item_block = item_block if item_block is not None else ItemBlock(items)
+        self._fingerprint = None
         self.logger = logging.getLogger("adjustment")
         self.basedir = basedir
 
@@ -21,22 +70,51 @@ class PricingEvent(object):
                (self.name, self.locations, self.items)
 
     def get_export_rows(self):
-        rv = [self.headers[0], self.headers[1]]
-        rv.append(["L"] + self.locations)
-        rv.append(["D", "Sku", "Style", "Color", "New Price"])  # header for items
+        return [self.headers[0], self.headers[1]] + list(self.iter_event_rows())
 
-        rv += [["", "", item.item_style_code, item.item_color, item.item_price] for item in self.items]
-        return rv
+    def iter_event_rows(self):
+        """Generate location, item header and item rows."""
+
+        yield ["L"] + self.locations
+        yield ["D", "Sku", "Style", "Color", "New Price"]  # header for items
+
+        for item in self.items:
+            yield ["", "", item.item_style_code, item.item_color, item.item_price]
+
+    @property
+    def fingerprint(self):
+        """Hash of the file content: header, locations and items."""
+
+        if self._fingerprint is None:
+            h = hashlib.md5(self.header_block if self.header_block is not None else format_rows(self.headers))
+            h.update(format_rows([["L"] + self.locations]))
+            h.update(self.item_block.data)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
 
     @property
     def filename(self):  #
         return os.path.join(self.basedir, self.name)
 
     def export_tab_delimited(self):
-        self.logger.info("Writing MMS file: %s" % self.filename)
-        with open("%s.txt" % self.filename, 'wb') as f:
-            writer = csv.writer(f, dialect=csv.excel, delimiter="\t")
-            [writer.writerow(row) for row in self.get_export_rows()]
+        """Write event to a temporary file and rename it when complete, MMS never sees a partial file.
+        Returns number of bytes written."""
+
+        self.logger.info("Writing MMS file: %s", self.filename)
+        file_name = "%s.txt" % self.filename
+        temp_file_name = cache.temp_name(file_name)  # concurrent writers of the same event do not share it
+        try:
+            with open(temp_file_name, 'wb', self.WRITE_BUFFER_SIZE) as f:
+                f.write(self.header_block if self.header_block is not None else format_rows(self.headers))
+                f.write(format_rows([["L"] + self.locations]))
+                f.write(self.item_block.data)
+                size = f.tell()
+
+            cache.replace(temp_file_name, file_name)
+        finally:
+            if os.path.exists(temp_file_name):  # write failed, do not leave partial files to MMS inbound
+                os.remove(temp_file_name)
+        return size
 
 class Adjustment(object):
     def __init__(self, oid, external_id, name, event, rule_name):
@@ -47,7 +125,9 @@ class Adjustment(object):
         self.rule_name = rule_name
         self.descriptions = {}  # language id -> AdjustmentDescription()
         self.schedule = None
-        self.zone_sets = set() # will be updated by controller after reading store information file
+        self._header = None  # (header key, [header names, header values])
+        self._header_block = None  # (header key, formatted header rows)
+        self.zone_index = None  # shared ZoneIndex, will be set by controller from store information file
 
         self.hierarchy = {  # user, customer, location, product
             "U": [],
@@ -58,21 +138,64 @@ class Adjustment(object):
 
         self.parameters = {}  # parameter name -> AdjustmentParameter
         self.location_business = {}  # location id -> LocationBusiness
-        self.item_price = []
+        self.item_price = ItemPriceTable()
 
         self._MAX_EVENT_LOCATIONS = 25  # 25 or less stores/zones in one event (or file)
         self.logger = logging.getLogger("adjustment")
 
         self.basedir = '/tmp' if os.name == 'posix' else r'C:\temp'
 
+    @property
+    def zone_sets(self):
+        """Pricing zone -> frozenset of store ids."""
+
+        return self.zone_index.zones if self.zone_index else {}
+
+    def __getstate__(self):
+        """Loggers cannot be pickled -> leave logger out when adjustment is sent to an export process."""
+
+        state = self.__dict__.copy()
+        del state["logger"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger("adjustment")
+
+    HEADER_PARAMETERS = ("Country", "PriceCode", "EventType", "ReasonCode", "DataType", "BasedOn", "OverrideAll")
+
+    def clear_headers(self):
+        self._header = None
+        self._header_block = None
+
+    def header_key(self):
+        """Return everything the header is built from: name, schedule and header parameter values. Cached
+        header is rebuilt when the key changes, however the parameters were set."""
+
+        parameters = self.parameters
+        return (self.name, self.schedule) + tuple(parameters[name].value for name in self.HEADER_PARAMETERS)
+
     def get_header(self):
-        """Return two lists: 1st header names, 2nd header values"""
+        """Return two lists: 1st header names, 2nd header values. Header is built once per header key, lists
+        are shared and must not be modified."""
+
+        key = self.header_key()
+        if self._header is None or self._header[0] != key:
+            self._header = key, self.build_header(self.parameters["Country"].value)
+        return self._header[1]
+
+    def get_header_block(self):
+        """Return header rows formatted for MMS file."""
 
+        key = self.header_key()
+        if self._header_block is None or self._header_block[0] != key:
+            self._header_block = key, format_rows(self.get_header())
+        return self._header_block[1]
+
+    def build_header(self, country):
         header_names = ["H", "Description", "Price Code", "Event Type", "Reason Code", "Country", "Data Type",
                         "Based On", "Override All", "Start Date", "End Date", "% Off"]
 
-        country = self.parameters["Country"].value
-
         header_values = ["H"]
         header_values.append(self.name)
         header_values.append(self.parameters["PriceCode"].value)
@@ -98,53 +221,60 @@ class Adjustment(object):
 
         return {i + 1: location_chunks[i] for i in range(len(location_chunks))}
 
-    def get_pricing_events(self):
+    def get_pricing_events(self, report=None):
+        """Return pricing events of the adjustment. Times of the grouping stages are added to report."""
 
+        report = report or RunReport()
         self.validate()
 
-        d = collections.defaultdict(set)
-        [d[ip].add(ip.location_external_id) for ip in self.item_price]  # location is not part of key
+        start_time = report.start()
+        item_locations = self.item_price.item_locations()
 
-        # d is now a dictionary with item prices as keys (without location info) and values are sets of locations
+        # item_locations lists item prices (without location info) in export order with the set of locations
         # where that specific item is available. Next step is to use the locations as dict keys and list all items
         # available there. And then the end result is a list of locations sharing identical list of items.
 
         d2 = collections.defaultdict(list)
-        [d2[str(sorted(v))].append(k) for k, v in d.items()]  # need to use str() to store set as key
+        [d2[frozenset(v)].append(rank) for rank, (k, v) in enumerate(item_locations)]
 
-        # d2: sorted list of locations as keys, values list of items for that list of locations
+        # d2: set of locations as keys, values sorted list of item ranks (positions in item_locations)
+        report.stop("group_locations", start_time)
 
-        from operator import attrgetter
-        for k, v in d2.items():
-            d2[k] = sorted(v, key=attrgetter('item_style_code', 'item_color')) # sort item list by style, color
+        # replace stores with zones, groups that end up with identical locations are merged
 
-        # check if event contains all stores for a zone and if so, replace store list with the zone
-
-        for location_list in d2.keys():
-            use_zones = False
-
-            location_set = set(eval(location_list))
-            for zone in self.zone_sets:
-                if self.zone_sets[zone].issubset(location_set):
-                    use_zones = True
-                    location_set = location_set - self.zone_sets[zone]
-                    location_set.add(zone)
-
-            if use_zones:
-                new_key = str(sorted(list(location_set)))
-                d2[new_key] = d2.pop(location_list)
-                self.logger.info("Replaced store list %s with zone %s" % (location_list, new_key))
-
-        # done store -> zone update
+        start_time = report.start()
+        groups = collections.OrderedDict()  # location set -> item rank lists, in order of store lists
+        for location_set in sorted(d2, key=sorted):
+            groups.setdefault(self.replace_stores_with_zones(location_set), []).append(d2[location_set])
+        report.stop("replace_zones", start_time)
 
+        start_time = report.start()
+        headers = self.get_header()
+        header_block = self.get_header_block()
         pricing_events = []
-        for index, key_locations in enumerate(d2, 1):
-            locations = self.get_location_business_map(sorted(eval(key_locations))) # eval returns str back to list
+        for index, (location_set, ranks) in enumerate(groups.items(), 1):
+            ranks = ranks[0] if len(ranks) == 1 else heapq.merge(*ranks)  # merged groups: merge sorted lists
+            items = [item_locations[rank][0] for rank in ranks]
+            item_block = ItemBlock(items)  # all files of the group have the same items
+            locations = self.get_location_business_map(sorted(location_set))
             for key in locations:
-                pricing_events.append(PricingEvent("%s_%s_%s" % (self.name, index, key), self.get_header(),
-                                                   locations[key], d2[key_locations], self.basedir))
+                pricing_events.append(PricingEvent("%s_%s_%s" % (self.name, index, key), headers,
+                                                   locations[key], items, self.basedir, header_block, item_block))
+        report.stop("create_events", start_time)
+        report.count("location_groups", len(groups))
         return pricing_events
 
+    def replace_stores_with_zones(self, location_set):
+        """Check if location set contains all stores of a zone and if so, replace those stores with the zone."""
+
+        if self.zone_index is None:
+            return location_set
+
+        rv = self.zone_index.replace_stores_with_zones(location_set)
+        if rv is not location_set and self.logger.isEnabledFor(logging.INFO):  # do not sort sets for nothing
+            self.logger.info("Replaced store list %s with zone %s", sorted(location_set), sorted(rv))
+        return rv
+
     def validate(self):
 
         self.validate_country()
@@ -175,6 +305,7 @@ class AdjustmentSchedule(object):
     }
 
     def __init__(self, start_date, end_date, start_time, duration, mon, tue, wed, thu, fri, sat, sun):
+        self._formatted_dates = {}  # (date, country) -> date in export format
         self._start_date = datetime.datetime.strptime(start_date, self.INPUT_DATE_FORMAT) if start_date else ''
         self._end_date = datetime.datetime.strptime(end_date, self.INPUT_DATE_FORMAT) if end_date else ''
         self.start_time = start_time
@@ -188,10 +319,18 @@ class AdjustmentSchedule(object):
         self.sun = sun
 
     def start_date(self, country="USA"):
-        return datetime.datetime.strftime(self._start_date, self.EXPORT_FORMATS[country]) if self._start_date else ''
+        return self.format_date(self._start_date, country)
 
     def end_date(self, country="USA"):
-        return datetime.datetime.strftime(self._end_date, self.EXPORT_FORMATS[country]) if self._end_date else ''
+        return self.format_date(self._end_date, country)
+
+    def format_date(self, date, country):
+        try:
+            return self._formatted_dates[(date, country)]
+        except KeyError:
+            formatted = datetime.datetime.strftime(date, self.EXPORT_FORMATS[country]) if date else ''
+            self._formatted_dates[(date, country)] = formatted
+            return formatted
 
 
 class AdjustmentParameters(object):
@@ -288,3 +427,206 @@ class ItemPrice(object):
         return "<ItemPrice: currency=%s, price=%s, product group=%s, item style code=%s, color=%s, variant name=%s, start date=%s, end date=%s>" % \
                (self.currency, self.item_price, self.product_group_id, self.item_style_code, self.item_color,
                 self.variant_item_name, self.start_date, self.end_date)
+
+
+# Item price fields without location. Equal keys are equal ItemPrices, see ItemPrice.__eq__
+ItemKey = collections.namedtuple('ItemKey', ['start_date', 'end_date', 'product_group_id', 'item_style_code',
+                                             'item_color', 'variant_item_name', 'item_price', 'currency'])
+
+
+def make_item_key(fields):
+    return ItemKey(*map(intern, fields))
+
+
+class ValuePool(object):
+    """Store each distinct value once and refer to it with an integer code."""
+
+    def __init__(self, make=None):
+        self.values = []  # code -> value
+        self._codes = {}  # value -> code
+        self._make = make  # creates stored value from a new key, e.g. with interned strings
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, key):
+        try:
+            return self._codes[key]
+        except KeyError:
+            value = self._make(key) if self._make else key
+            self._codes[value] = len(self.values)
+            self.values.append(value)
+            return self._codes[value]
+
+
+class ItemPriceTable(object):
+    """Item prices of an adjustment stored in columns of integer codes instead of ItemPrice objects.
+
+    A row is a hierarchy context (the seven user/customer/location hierarchy fields), a location id and an
+    ItemKey. Each distinct value is stored once in a pool, so a row costs three integers. Indexing returns
+    the row as an ItemPrice.
+
+    A style price is stored as one style row whatever the number of color variants of the style, and
+    variant prices overriding it are kept in a sparse map. Style rows are expanded to a price per variant
+    only when item locations are collected for export. Indexes of the expanded prices follow the rows."""
+
+    CONTEXT_FIELDS = 7  # ItemPrice fields before location_external_id
+    COLOR_FIELD = ItemKey._fields.index('item_color')
+    VARIANT_FIELD = ItemKey._fields.index('variant_item_name')  # follows COLOR_FIELD
+
+    def __init__(self):
+        self.contexts = ValuePool()
+        self.locations = ValuePool(intern)
+        self.items = ValuePool(make_item_key)
+
+        self.context_codes = array.array('i')
+        self.location_codes = array.array('i')
+        self.item_codes = array.array('i')
+
+        self.style_variants = {}  # style code -> ((variant code, color), ...) of the style
+        self.style_context_codes = array.array('i')
+        self.style_location_codes = array.array('i')
+        self.style_item_codes = array.array('i')  # style price, color and variant are replaced in expansion
+        self.style_offsets = array.array('i')  # index of first expanded price of each style row after rows
+        self.overrides = {}  # (style row, variant code) -> (context code, item code) of overriding variant price
+        self._expanded = 0  # number of prices style rows expand to
+
+    def __len__(self):
+        return len(self.item_codes) + self._expanded
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < len(self.item_codes):
+            return ItemPrice(*(self.contexts.values[self.context_codes[index]] +
+                               (self.locations.values[self.location_codes[index]],) +
+                               self.items.values[self.item_codes[index]]))
+
+        row, variant, color = self.style_variant(index)
+        location = self.locations.values[self.style_location_codes[row]]
+        try:
+            context, item = self.overrides[(row, variant)]
+            key = self.items.values[item]
+        except KeyError:
+            context = self.style_context_codes[row]
+            key = self.variant_key(self.items.values[self.style_item_codes[row]], variant, color)
+        return ItemPrice(*(self.contexts.values[context] + (location,) + key))
+
+    def __setitem__(self, index, fields):
+        """Replace row at index with ItemPrice fields. Replacing an expanded style price overrides it."""
+
+        if index < 0:
+            index += len(self)
+        if index < len(self.item_codes):
+            context, location, item = self.encode(fields)
+            self.context_codes[index] = context
+            self.location_codes[index] = location
+            self.item_codes[index] = item
+        else:
+            self.override(self.style_variant(index)[0], fields)
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self)))
+
+    def append(self, fields):
+        """Add row from ItemPrice fields and return its index."""
+
+        context, location, item = self.encode(fields)
+        self.context_codes.append(context)
+        self.location_codes.append(location)
+        self.item_codes.append(item)
+        return len(self.item_codes) - 1
+
+    def append_style(self, fields, variants):
+        """Add style price from ItemPrice fields. variants is color variant code -> color of the style, the
+        same for every price of the style. Return style row."""
+
+        context, location, item = self.encode(fields)
+        style = self.items.values[item].item_style_code
+        if style not in self.style_variants:
+            self.style_variants[style] = tuple(variants.items())
+        self.style_context_codes.append(context)
+        self.style_location_codes.append(location)
+        self.style_item_codes.append(item)
+        self.style_offsets.append(self._expanded)
+        self._expanded += len(self.style_variants[style])
+        return len(self.style_item_codes) - 1
+
+    def override(self, style_row, fields):
+        """Replace the price of a color variant (variant_item_name of ItemPrice fields) of style row."""
+
+        context, location, item = self.encode(fields)
+        self.overrides[(style_row, fields[self.CONTEXT_FIELDS + 1 + self.VARIANT_FIELD])] = context, item
+
+    def style_variant(self, index):
+        """Return style row, variant code and color of expanded price at index."""
+
+        position = index - len(self.item_codes)
+        if not 0 <= position < self._expanded:
+            raise IndexError("Item price index out of range: %d" % index)
+        row = bisect.bisect_right(self.style_offsets, position) - 1
+        variants = self.style_variants[self.items.values[self.style_item_codes[row]].item_style_code]
+        return (row,) + variants[position - self.style_offsets[row]]
+
+    def variant_key(self, style_key, variant, color):
+        """Return ItemKey of style price style_key for one color variant."""
+
+        return ItemKey._make(style_key[:self.COLOR_FIELD] + (color, variant) + style_key[self.VARIANT_FIELD + 1:])
+
+    def encode(self, fields):
+        if len(fields) != self.CONTEXT_FIELDS + 1 + len(ItemKey._fields):
+            raise TypeError("Item price needs %d fields, got %d: %s" %
+                            (self.CONTEXT_FIELDS + 1 + len(ItemKey._fields), len(fields), fields))
+        return (self.contexts.code(tuple(fields[:self.CONTEXT_FIELDS])),
+                self.locations.code(fields[self.CONTEXT_FIELDS]),
+                self.items.code(tuple(fields[self.CONTEXT_FIELDS + 1:])))
+
+    def location_items(self):
+        """Return (location id, ItemKey) pair of each row and expanded style price."""
+
+        locations, items = self.locations.values, self.items.values
+        for l, i in itertools.izip(self.location_codes, self.item_codes):
+            yield locations[l], items[i]
+        for row, (l, i) in enumerate(itertools.izip(self.style_location_codes, self.style_item_codes)):
+            for variant, color in self.style_variants[items[i].item_style_code]:
+                override = self.overrides.get((row, variant))
+                yield locations[l], items[override[1]] if override else self.variant_key(items[i], variant, color)
+
+    def item_locations(self):
+        """Return (ItemKey, set of location ids) of each distinct item in export order: by style and color,
+        items of the same style and color by the remaining key fields. Items are sorted once here, so any
+        subset of the list taken in list order is sorted too."""
+
+        items, location_values = self.items.values, self.locations.values
+        locations = collections.defaultdict(set)  # ItemKey -> location ids
+        for l, i in itertools.izip(self.location_codes, self.item_codes):
+            locations[items[i]].add(location_values[l])
+
+        # Style rows are expanded per distinct style price, not per row: each variant of the price is at the
+        # locations of its rows, except where every row at the location has an override for the variant.
+        style_locations = collections.defaultdict(set)  # style price item code -> location ids
+        repeated = collections.Counter()  # (style price, location id) -> rows after the first one
+        for l, i in itertools.izip(self.style_location_codes, self.style_item_codes):
+            location = location_values[l]
+            if location in style_locations[i]:
+                repeated[(i, location)] += 1
+            style_locations[i].add(location)
+
+        overridden = collections.defaultdict(collections.Counter)  # (style price, variant) -> location -> rows
+        for (row, variant), (context, item) in self.overrides.iteritems():
+            location = location_values[self.style_location_codes[row]]
+            overridden[(self.style_item_codes[row], variant)][location] += 1
+            locations[items[item]].add(location)
+
+        for i, style_ids in style_locations.iteritems():
+            style_key = items[i]
+            for variant, color in self.style_variants[style_key.item_style_code]:
+                variant_ids = style_ids
+                if (i, variant) in overridden:
+                    variant_ids = variant_ids - set(location for location, rows in overridden[(i, variant)].iteritems()
+                                                    if rows > repeated[(i, location)])
+                locations[self.variant_key(style_key, variant, color)].update(variant_ids)
+
+        style, color = ItemKey._fields.index('item_style_code'), ItemKey._fields.index('item_color')
+        order = sorted((item[style], item[color], item, ids) for item, ids in locations.iteritems() if ids)
+        return [(item, ids) for _, _, item, ids in order]  # replaced rows leave unused items
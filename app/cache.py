@@ -0,0 +1,87 @@
+import logging
+import marshal
+import os
+import thread
+
+CACHE_VERSION = 2  # increase when layout of cached data changes
+
+logger = logging.getLogger("cache")
+
+
+def source_signature(source_file):
+    """Return value identifying the current content of source file: path, size and modification time."""
+
+    return CACHE_VERSION, os.path.abspath(source_file), os.path.getsize(source_file), os.path.getmtime(source_file)
+
+
+def load(cache_file, source_file, build):
+    """Return data built from source_file. Data is read from cache_file if that was built from the
+    same version of source file, otherwise build() is called and its result is written to cache_file.
+    Data must contain only types supported by marshal (dicts, lists, tuples, sets, strings, numbers)."""
+
+    signature = source_signature(source_file)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_signature, data = marshal.load(f)
+        if cached_signature == signature:
+            logger.info("Loaded %s from cache file %s" % (source_file, cache_file))
+            return data
+        logger.info("Cache file %s is out of date" % cache_file)
+    except (IOError, EOFError, ValueError, TypeError):
+        logger.info("Cache file %s not found or not readable" % cache_file)
+
+    data = build()
+    save(cache_file, signature, data)
+    return data
+
+
+def save(cache_file, signature, data):
+    """Write signature and data to cache_file."""
+
+    try:
+        write(cache_file, (signature, data))
+    except (IOError, OSError), e:
+        logger.warning("Could not write cache file %s: %s" % (cache_file, e))
+
+
+def write(file_name, data):
+    """Marshal data to file. File is written to a temporary name first so that a concurrent reader never
+    sees a partial file."""
+
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    temp_file = temp_name(file_name)
+    try:
+        with open(temp_file, 'wb') as f:
+            marshal.dump(data, f)
+        replace(temp_file, file_name)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def temp_name(file_name):
+    """Return temporary name for writing file_name, unique to the writing process and thread."""
+
+    return "%s.%d.%d.tmp" % (file_name, os.getpid(), thread.get_ident())
+
+
+def replace(temp_file, file_name):
+    """Rename completely written temp_file to file_name, replacing file_name if it exists."""
+
+    if os.name == 'nt' and os.path.exists(file_name):  # rename does not replace files on Windows
+        os.remove(file_name)
+    os.rename(temp_file, file_name)
+
+
+def read(file_name, default=None):
+    """Return data marshalled to file or default if file does not exist or cannot be read."""
+
+    try:
+        with open(file_name, 'rb') as f:
+            return marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return default
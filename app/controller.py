@@ -1,23 +1,37 @@
 import collections
 import glob
+import multiprocessing
 import os
 
+from app import cache, parser
+from app.delta import FingerprintStore
+from app.index import ItemIndex, ZoneIndex
+from app.logqueue import queued_file_handler
+from app.report import RunReport
+from app.writer import EventWriter
 from app.adjustment import Adjustment, AdjustmentDescription, AdjustmentSchedule, UserHierarchyNode, \
-    CustomerHierarchyNode, LocationHierarchyNode, ProductHierarchyNode, AdjustmentParameters, LocationBusiness, \
-    ItemPrice
+    CustomerHierarchyNode, LocationHierarchyNode, ProductHierarchyNode, AdjustmentParameters, LocationBusiness
 
 class ExportController(object):
 
     def __init__(self, property_file='/Users/jaska/Work/JDA_Guess/test/Guess.properties'):
         self._current_adjustment_oid = None
-        self.adjustments = {}
+        self.adjustments = collections.OrderedDict()  # oid -> Adjustment, in publish file order
         self._style_to_variant_map = None
+        self._item_index = None
+        self._item_info_signature = None  # item information file the map or index was built from
         self._item_info_file = None
         self._store_info_file = None
-        self.item_price_index = 0 # how many entries in item price list
-        self.item_price_map = {} # store location|color variant -> index in item price list
+        self.item_price_map = {} # store location|style -> latest style row of the style in item price table
+        self.location_ids = set()  # store and zone ids item prices of current adjustment may refer to
         self.filter_counter = 0
         self.logger = None
+        self._export_pool = None
+        self._pending_exports = []
+        self._handlers = {code: getattr(self, name) for code, name in self.DATA_TYPES.items()}
+        self._record_stages = {code: "parse.%s" % code for code in self.DATA_TYPES}
+        self.report = RunReport()  # timings and counters of the current publish file
+        self.memory_profiler = None  # app.memory.MemoryProfiler measuring memory of each stage, if profiling
 
         self.setup(property_file)
 
@@ -29,15 +43,45 @@ class ExportController(object):
         self.basedir = cfg.get("MMS", "input_dir")
         self.output_dir = cfg.get("MMS", "output_dir")
 
+        # streaming: export each adjustment as soon as the next one starts and release its item prices
+        self.streaming = cfg.has_option("MMS", "streaming") and cfg.getboolean("MMS", "streaming")
+        # number of processes creating and writing pricing events, 1 = export in controller process
+        self.export_workers = cfg.getint("MMS", "export_workers") if cfg.has_option("MMS", "export_workers") else 1
+        # number of threads writing MMS files of one adjustment, 1 = write files one after another
+        self.writer_threads = cfg.getint("MMS", "writer_threads") if cfg.has_option("MMS", "writer_threads") else 1
+        # directory for compiled item/store information, no caching if not set
+        self.cache_dir = cfg.get("MMS", "cache_dir") if cfg.has_option("MMS", "cache_dir") else None
+        # delta: write only pricing events that are new or changed since the previous run of the adjustment
+        self.delta = cfg.has_option("MMS", "delta") and cfg.getboolean("MMS", "delta")
+        if self.delta and not self.cache_dir:
+            raise SystemExit("Delta conversion needs cache_dir for event fingerprints: %s" % property_file)
+        # memory: load whole item information file, index: read rows of each style on demand
+        self.item_lookup = cfg.get("MMS", "item_lookup") if cfg.has_option("MMS", "item_lookup") else "memory"
+        self.item_cache_size = cfg.getint("MMS", "item_cache_size") \
+            if cfg.has_option("MMS", "item_cache_size") else 10000
+        # split: str.split per line, csv: csv module reader, for publish, item and store information files
+        try:
+            self.parser = parser.get_parser(cfg.get("MMS", "parser") if cfg.has_option("MMS", "parser") else "split")
+        except ValueError, e:
+            raise SystemExit("%s: %s" % (e, property_file))
+        # JSON run report with stage timings and counters of each publish file, not written if not set
+        self.report_file = cfg.get("MMS", "report_file") if cfg.has_option("MMS", "report_file") else None
+
         import logging
 
         logging.basicConfig(level=eval("logging.%s" % cfg.get("MMS", "log_level")))
-        fh = logging.FileHandler(cfg.get("MMS", "log_file"))
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
+        # log_queue: write log file in a background thread, false = write in the logging thread
+        if not cfg.has_option("MMS", "log_queue") or cfg.getboolean("MMS", "log_queue"):
+            fh = queued_file_handler(cfg.get("MMS", "log_file"), formatter)
+        else:
+            fh = logging.FileHandler(cfg.get("MMS", "log_file"))
+            fh.setFormatter(formatter)
 
         self.logger = logging.getLogger("controller")
-        self.logger.addHandler(fh)
+        if fh not in self.logger.handlers:
+            self.logger.addHandler(fh)
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)  # checked before formatting hot path messages
         self.logger.info("Reading configuration from %s" % property_file)
 
     @property
@@ -79,23 +123,49 @@ class ExportController(object):
     @property
     def style_to_variant_map(self):
         if not self._style_to_variant_map:
-            self.logger.info("Loading item information from file: %s" % self.item_info_file)
-
-            ItemInfo = collections.namedtuple('ItemInfo',
-                                              ['variant_code', 'description', 'a', 'style_code', 'c', 'd', 'e', 'f',
-                                               'color',
-                                               'size', 'g', 'filter_code', 'h'])
-            self._style_to_variant_map = collections.defaultdict(dict)
-            with open(self.item_info_file, 'r') as f:
-                for ii in map(ItemInfo._make, [line.split('|') for line in f]):
-                    if ii.filter_code <> '0': # filter out unwanted items
-                        self.filter_counter += 1
-                        continue
-                    self._style_to_variant_map[ii.style_code][ii.variant_code] = ii.color
-
-            self.logger.info("Completed loading item information. Filtered %d items." % self.filter_counter)
+            start_time = self.report.start()
+            self._item_info_signature = cache.source_signature(self.item_info_file)
+            if self.cache_dir:
+                variants, self.filter_counter = cache.load(os.path.join(self.cache_dir, 'style_to_variant.cache'),
+                                                           self.item_info_file, self.load_item_info)
+            else:
+                variants, self.filter_counter = self.load_item_info()
+            self._style_to_variant_map = collections.defaultdict(dict, variants)
+            self.report.stop("load_item_info", start_time)
+
         return self._style_to_variant_map
 
+    @property
+    def item_index(self):
+        if self._item_index is None:
+            start_time = self.report.start()
+            self._item_info_signature = cache.source_signature(self.item_info_file)
+            self._item_index = ItemIndex(self.item_info_file, self.cache_dir, self.item_cache_size)
+            self.filter_counter = self._item_index.filtered
+            self.report.stop("load_item_info", start_time)
+        return self._item_index
+
+    def load_item_info(self):
+        """Read item information file. Return style code -> {variant code: color} dictionary and number
+        of filtered items."""
+
+        self.logger.info("Loading item information from file: %s" % self.item_info_file)
+
+        variant_field, style_field, color_field, filter_field = \
+            ItemIndex.VARIANT_FIELD, ItemIndex.STYLE_FIELD, ItemIndex.COLOR_FIELD, ItemIndex.FILTER_FIELD
+        variants = collections.defaultdict(dict)
+        filter_counter = 0
+        with open(self.item_info_file, 'r') as f:
+            for fields in self.parser.records(f):
+                ItemIndex.check_fields(fields)
+                if fields[filter_field] <> '0': # filter out unwanted items
+                    filter_counter += 1
+                    continue
+                variants[fields[style_field]][fields[variant_field]] = fields[color_field]
+
+        self.logger.info("Completed loading item information. Filtered %d items." % filter_counter)
+        return dict(variants), filter_counter  # plain dict for marshal
+
     DATA_TYPES = {
         "A" : "add_adjustment",
         "D" : "add_description",
@@ -111,17 +181,20 @@ class ExportController(object):
     }
 
     def process_line(self, line):
-        fields = line.split("|")
-        field_type = fields[0]
-        type = self.DATA_TYPES.get(field_type)
-        if type:
-            exec "self.%s(%s)" % (type, fields[1:])
+        self.process_record(line.split("|"))
+
+    def process_record(self, fields):
+        handler = self._handlers.get(fields[0])  # record type -> bound add_* method, see DATA_TYPES
+        if handler:
+            handler(fields[1:])
         else:
-            raise Exception("Invalid data type on line: %s" % line)
+            raise Exception("Invalid data type on line: %s" % "|".join(fields))
 
     def add_adjustment(self, fields):
         oid, external_id, description, event, rule_name = fields
         self._current_adjustment_oid = oid
+        self.item_price_map = {}  # item price indexes refer to the item price table of current adjustment
+        self.location_ids = set()
         a = Adjustment(*fields)
         a.basedir = self.output_dir
         self.adjustments[oid] = a
@@ -147,14 +220,15 @@ class ExportController(object):
 
     def add_parameters(self, fields):
         parameter_name = fields[0]
-        self.current_adjustment.parameters[parameter_name] =(AdjustmentParameters(*fields))
+        self.current_adjustment.parameters[parameter_name] = AdjustmentParameters(*fields)
 
     def add_location_business(self, fields):
         location_id = fields[0]
         if not location_id in self.current_adjustment.location_business:
             self.current_adjustment.location_business[location_id] = LocationBusiness(*fields)
+            self.location_ids.add(location_id)
 
-        if not self.current_adjustment.zone_sets:
+        if self.current_adjustment.zone_index is None:
             self.update_adjustment_zones()
 
     def add_item_price(self, fields):
@@ -164,59 +238,208 @@ class ExportController(object):
         if not location_id: # this price uses zone instead of store
             location_id = fields[6]
             fields[7] = location_id
-        elif not location_id in a.location_business.keys() + list(a.zone_sets):
+        elif not location_id in self.location_ids:
             raise Exception("Location business %s not found for item price: %s" % (location_id, fields))
 
         style_code = fields[11]
         variant_code = fields[13]
-        price = fields[14]
         codes = self.get_color_codes_for_style(style_code)
 
-        variant_key = "%s|%s" % (location_id, variant_code)
-
-        if variant_code == '':  # style item
-            self.logger.debug("%s: style item with %d colors" % (style_code, len(codes)))
-            for variant_code, variant_color in codes.items():
-                color_fields = fields
-                color_fields[12] = variant_color
-                color_fields[13] = variant_code
-                variant_key = "%s|%s" % (location_id, variant_code)
-                self.current_adjustment.item_price.append(ItemPrice(*color_fields))
-                self.item_price_map[variant_key] = self.item_price_index
-                self.item_price_index += 1
+        style_key = "%s|%s" % (location_id, style_code)
+
+        if variant_code == '':  # style item, counted instead of logged per row, see log_item_price_summary
+            self.report.counters["style_expansions"] += 1
+            self.report.counters["expanded_variants"] += len(codes)
+            self.item_price_map[style_key] = a.item_price.append_style(fields, codes)  # expanded on export
         else:
-            self.logger.debug("%s is a variant item -> override style price with %s" % (variant_code, price))
+            self.report.counters["variant_overrides"] += 1
             try:
                 fields[12] = codes[variant_code] # get color from item info
-                self.current_adjustment.item_price[self.item_price_map[variant_key]] = ItemPrice(*fields)
+                a.item_price.override(self.item_price_map[style_key], fields)
             except KeyError:
-                self.logger.debug("Did not find color variant %s from style map (style: %s)" % (variant_code, style_code))
+                self.report.counters["missing_variants"] += 1
+                if self._debug:
+                    self.logger.debug("Did not find color variant %s from style map (style: %s)",
+                                      variant_code, style_code)
+
+    def log_item_price_summary(self):
+        counters = self.report.counters
+        self.logger.info("Expanded %d style prices to %d color variants, %d variant prices override them, "
+                         "%d variant prices have no color variant in item information" %
+                         (counters["style_expansions"], counters["expanded_variants"],
+                          counters["variant_overrides"], counters["missing_variants"]))
 
     def process_file(self, file_name):
         self.logger.info("Reading adjustment publish file: %s" % file_name)
-        with open(file_name, 'r') as f:
-            [self.process_line(line.rstrip()) for line in f ]
+        try:
+            self.report = report = RunReport(self.memory_profiler)
+            record_counts = collections.defaultdict(int)  # record type -> records
+            record_type = start_time = None  # records of a type come in runs, each run is timed as one stage
+            timed = bool(self.report_file or self.memory_profiler)
+            with open(file_name, 'r') as f:
+                for fields in self.parser.records(f):
+                    if self.streaming and fields[0] == "A" and self._current_adjustment_oid:
+                        if record_type is not None:  # export is not part of the record run
+                            report.stop(self._record_stages.get(record_type, "parse.invalid"), start_time)
+                            record_type = None
+                        self.export_adjustment(self.release_current_adjustment())  # previous block is complete
+                    if timed:
+                        record_counts[fields[0]] += 1
+                        if fields[0] != record_type:
+                            if record_type is not None:
+                                report.stop(self._record_stages.get(record_type, "parse.invalid"), start_time)
+                            record_type, start_time = fields[0], report.start()
+                    self.process_record(fields)
+                if record_type is not None:
+                    report.stop(self._record_stages.get(record_type, "parse.invalid"), start_time)
+            for code, n in record_counts.items():
+                report.count("records.%s" % code, n)
+
+            if self.streaming:
+                if self._current_adjustment_oid:
+                    self.export_adjustment(self.release_current_adjustment())
+            else:
+                for a in self.adjustments.values():
+                    self.export_adjustment(a)
+
+            self.wait_for_exports()
+            self.log_item_price_summary()
+
+            if self.report_file:
+                if self._style_to_variant_map or self._item_index is not None:
+                    self.report.counters["filtered_items"] = self.filter_counter
+                self.report.write(self.report_file, publish_file=os.path.abspath(file_name))
+                self.logger.info("Wrote run report %s" % self.report_file)
+        except:
+            self.abort_exports()  # a warm controller must not collect exports of the failed file later
+            raise
+        if self.memory_profiler:
+            self.memory_profiler.log_summary(self.logger)
+
+    def export_adjustment(self, adjustment):
+        """Write pricing events of adjustment here or, if export_workers > 1, in the export process pool.
+        Export work outside the stages of write_pricing_events, e.g. waiting for the pool, is timed as the
+        export stage."""
+
+        with self.report.stage("export"):
+            if self.export_workers < 2:
+                write_pricing_events(adjustment, self.writer_threads, self.fingerprint_dir, self.report)
+                return
+
+            if self._export_pool is None:
+                self.logger.info("Starting %d export worker processes" % self.export_workers)
+                self._export_pool = multiprocessing.Pool(self.export_workers)
+
+            if len(self._pending_exports) >= 2 * self.export_workers:  # limit adjustments waiting in the pool
+                self.report.merge(self._pending_exports.pop(0).get())
+
+            self._pending_exports.append(self._export_pool.apply_async(
+                write_pricing_events, (adjustment, self.writer_threads, self.fingerprint_dir)))
+
+    @property
+    def fingerprint_dir(self):
+        return os.path.join(self.cache_dir, 'fingerprints') if self.delta else None
+
+    def wait_for_exports(self):
+        """Wait until all adjustments given to the export pool have been written. Re-raises worker errors."""
 
-        [e.export_tab_delimited() for e in self.current_adjustment.get_pricing_events()]
+        try:
+            with self.report.stage("wait_for_exports"):
+                while self._pending_exports:
+                    self.report.merge(self._pending_exports.pop(0).get())
+        finally:
+            if self._export_pool is not None:
+                self._export_pool.close()
+                self._export_pool.join()
+                self._export_pool = None
+
+    def abort_exports(self):
+        """Stop the export pool without waiting for adjustments given to it."""
+
+        self._pending_exports = []
+        if self._export_pool is not None:
+            self._export_pool.terminate()
+            self._export_pool.join()
+            self._export_pool = None
+
+    def reset(self):
+        """Prepare the controller for the next publish file: forget the adjustments of the previous file and
+        drop item information if a newer item information file has arrived. Store information is reloaded
+        by ZoneIndex.load when the store file changes."""
+
+        self.abort_exports()
+        self.adjustments.clear()
+        self._current_adjustment_oid = None
+        self.item_price_map = {}
+        self.location_ids = set()
+
+        if self._item_info_signature is not None and \
+                self._item_info_signature != cache.source_signature(self.item_info_file):
+            self.logger.info("Item information file has changed, reloading item information")
+            self._style_to_variant_map = None
+            if self._item_index is not None:
+                self._item_index.close()
+                self._item_index = None
+            self._item_info_signature = None
+
+    def release_current_adjustment(self):
+        """Remove current adjustment from the controller so that its item prices can be freed after export."""
+
+        a = self.adjustments.pop(self._current_adjustment_oid)
+        self._current_adjustment_oid = None
+        self.item_price_map = {}
+        self.location_ids = set()
+        return a
 
     def get_color_codes_for_style(self, style_item_code):
+        if self.item_lookup == "index":
+            return self.item_index.get(style_item_code)
         return self.style_to_variant_map[style_item_code]  # TODO: check for KeyError
 
     def update_adjustment_zones(self):
-        self.logger.info("Loading store information from %s" % self.store_info_file)
-        StoreInfo = collections.namedtuple('StoreInfo', ['store_code', 'a', 'b', 'c', 'd', 'e', 'f',
-                                           'zone_code', 'g', 'h', 'i'])
-
-        d = collections.defaultdict(set)
-        with open(self.store_info_file, 'r') as f:
-            for si in map(StoreInfo._make, [line.split('|') for line in f]):
-                d[si.zone_code].add(si.store_code)
-        self.current_adjustment.zone_sets = d
-        self.logger.info("Loaded %d zones" % len(d))
-        for k,v in sorted(d.items()):
-            self.logger.debug("Zone %s has %d stores" % (k, len(v)))
+        start_time = self.report.start()
+        self.current_adjustment.zone_index = ZoneIndex.load(self.store_info_file, self.cache_dir, self.parser)
+        self.report.stop("load_store_info", start_time)
+        self.location_ids.update(self.current_adjustment.zone_sets)
 
-        return self._style_to_variant_map
+
+def write_pricing_events(adjustment, writer_threads=1, fingerprint_dir=None, report=None):
+    """Create and write pricing events of one adjustment. Module level function so that the export
+    pool can run it in a worker process. Returns report (a new RunReport if not given) with the export
+    stages and counters added.
+
+    With fingerprint_dir only events that changed since the previous export of the adjustment are written."""
+
+    report = report or RunReport()
+    events = written = adjustment.get_pricing_events(report)
+    if fingerprint_dir:
+        with report.stage("select_changed_events"):
+            fingerprints = FingerprintStore(fingerprint_dir)
+            written = fingerprints.select(adjustment.oid, events).written
+
+    with report.stage("write_files"):
+        report.count("bytes_written", write_events(written, writer_threads))
+
+    if fingerprint_dir:
+        fingerprints.update(adjustment.oid, events)
+    report.count("events", len(events))
+    report.count("events_written", len(written))
+    return report
+
+
+def write_events(events, writer_threads=1):
+    """Write events, in writer_threads threads if more than one. Returns number of bytes written."""
+
+    if writer_threads < 2:
+        return sum(e.export_tab_delimited() for e in events)
+
+    writer = EventWriter(writer_threads)
+    try:
+        for e in events:
+            writer.write(e)
+    finally:
+        size = writer.close()
+    return size
 
 
 if __name__ == '__main__':
@@ -224,14 +447,21 @@ if __name__ == '__main__':
     args = sys.argv
     print len(args), args
 
+    profile_memory = "--profile-memory" in args
+    if profile_memory:
+        args = [arg for arg in args if arg != "--profile-memory"]
     if len(args) <> 3:
-        raise SystemExit("Usage: %s <property file> <export_file>" % args[0])
+        raise SystemExit("Usage: %s [--profile-memory] <property file> <export_file>" % args[0])
 
     property_file = args[1]
     export_file = args[2]
 
     try:
         c = ExportController(property_file)
+        if profile_memory:
+            from app.memory import MemoryProfiler
+            c.memory_profiler = MemoryProfiler()
+            c.export_workers = 1  # memory of export worker processes would not be measured
         c.process_file(export_file)
     except:
         import sys
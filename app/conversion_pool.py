@@ -0,0 +1,195 @@
+import glob
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from app.controller import ExportController
+from app.ledger import Ledger, file_key
+
+_controller = None  # controller of a pool process, kept between publish files
+
+
+def init_worker(property_file):
+    global _controller
+    _controller = ExportController(property_file)
+    if _controller.export_workers > 1:  # pool processes are daemonic and cannot start export pools
+        _controller.logger.info("Conversion pool process exports with export_workers = 1")
+        _controller.export_workers = 1
+
+
+def convert_publish_file(publish_file):
+    """Convert publish file with the controller of this pool process. Return publish file, conversion time
+    and error message (None if conversion succeeded)."""
+
+    start_time = time.time()
+    try:
+        _controller.reset()
+        _controller.process_file(publish_file)
+    except (Exception, SystemExit), e:
+        _controller.logger.error("Error in processing publish file %s: %s" % (publish_file, e))
+        return publish_file, time.time() - start_time, str(e) or e.__class__.__name__
+    return publish_file, time.time() - start_time, None
+
+
+def adjustment_keys(publish_file):
+    """Return oids and names of the adjustments in publish file. Conversions of files sharing an adjustment
+    write the same MMS files (named by adjustment name) and delta fingerprints (stored by oid)."""
+
+    keys = set()
+    with open(publish_file, 'r') as f:
+        for line in f:
+            if line.startswith("A|"):
+                fields = line.split('|', 4)
+                keys.add(("oid", fields[1]))
+                keys.add(("name", fields[3]))
+    return frozenset(keys)
+
+
+class ConversionPool(object):
+    """Converts every new publish file matching a glob pattern in a pool of controller processes.
+
+    Files are queued in modification time order once they have not been modified for settle_time seconds.
+    Files sharing an adjustment are converted one at a time in that order, so the MMS files and delta
+    fingerprints of the adjustment are those of the newest publish file. A file waits while an older file
+    with a common adjustment is converting or waiting.
+    Converted files are recorded in a ledger, so a file is not converted again after a restart unless it
+    has been uploaded again. A failed conversion (e.g. item information file not uploaded yet) is retried
+    at the next discovery, at most retries times.
+
+    A conversion that has not finished in timeout seconds, e.g. because its pool process was killed, is
+    counted as failed. The pool does not notice a killed process, so without a timeout close() would wait
+    for its conversion forever."""
+
+    def __init__(self, property_file, publish_files, ledger_file, workers=2, settle_time=2, retries=2,
+                 timeout=3600):
+        self.property_file = property_file
+        self.publish_files = publish_files
+        self.ledger = Ledger(ledger_file)
+        self.workers = workers
+        self.settle_time = settle_time
+        self.retries = retries
+        self.timeout = timeout
+        self.logger = logging.getLogger("pool")
+
+        self._pool = None
+        self._lock = threading.Lock()
+        # publish file -> (file key, discovery time, AsyncResult, adjustment keys), until conversion has finished
+        self._queued = {}
+        self._waiting = {}  # file key -> adjustment keys of files waiting for an older file
+
+    @property
+    def queue_depth(self):
+        """Number of publish files given to the pool processes and not converted yet."""
+
+        return len(self._queued)
+
+    def discover(self):
+        """Queue new publish files for conversion. Return seconds until the next file that is still being
+        written settles, None if there is no such file."""
+
+        self.expire()
+        now = time.time()
+        settle_wait = None
+        files = []  # (modification time, publish file, file key)
+        for publish_file in glob.iglob(self.publish_files):
+            try:
+                files.append((os.path.getmtime(publish_file), publish_file, file_key(publish_file)))
+            except OSError:  # removed after glob
+                continue
+
+        with self._lock:
+            busy = set()  # adjustment keys of queued and waiting files
+            for entry in self._queued.values():
+                busy.update(entry[3])
+        waiting = {}
+        for mtime, publish_file, key in sorted(files):
+            if publish_file in self._queued or key in self.ledger or self.ledger.failures(key) > self.retries:
+                continue
+            age = now - mtime
+            if age < self.settle_time:
+                settle_wait = min(settle_wait, self.settle_time - age) if settle_wait is not None \
+                    else self.settle_time - age
+                continue
+            adjustments = self._waiting.get(key)
+            if adjustments is None:
+                try:
+                    adjustments = adjustment_keys(publish_file)
+                except IOError:  # removed after glob
+                    continue
+            if adjustments & busy:
+                self.logger.info("%s waits for conversion of an older file of the same adjustment" % publish_file)
+                waiting[key] = adjustments
+            else:
+                self.submit(publish_file, key, adjustments)
+            busy.update(adjustments)
+        self._waiting = waiting
+        return settle_wait
+
+    def submit(self, publish_file, key, adjustments=frozenset()):
+        if self._pool is None:
+            self.logger.info("Starting %d conversion processes" % self.workers)
+            self._pool = multiprocessing.Pool(self.workers, init_worker, (self.property_file,))
+
+        with self._lock:  # callback must not run before the file is queued
+            result = self._pool.apply_async(convert_publish_file, (publish_file,), callback=self.converted)
+            self._queued[publish_file] = key, time.time(), result, adjustments
+        self.logger.info("Queued %s, %d files in queue" % (publish_file, self.queue_depth))
+
+    def converted(self, result):
+        """Record a finished conversion. Called in the result thread of the pool."""
+
+        publish_file, seconds, error = result
+        with self._lock:  # recorded in ledger before discover can see the file is no longer queued
+            entry = self._queued.get(publish_file)
+            if entry is not None:
+                key, discovery_time = entry[:2]
+                self.ledger.add(key, "failed" if error else Ledger.CONVERTED, seconds)
+                del self._queued[publish_file]
+        if entry is None:
+            self.logger.warning("Conversion of %s finished after timeout in %.3f s" % (publish_file, seconds))
+            return
+
+        if error:
+            self.logger.error("Conversion of %s failed: %s, %d files in queue" % (publish_file, error,
+                                                                                 self.queue_depth))
+            if self.ledger.failures(key) > self.retries:
+                self.logger.error("Giving up %s after %d failed conversions" % (publish_file,
+                                                                                self.ledger.failures(key)))
+        else:
+            self.logger.info("Converted %s in %.3f s, %.3f s after discovery, %d files in queue" %
+                             (publish_file, seconds, time.time() - discovery_time, self.queue_depth))
+
+    def expire(self):
+        """Count conversions running longer than timeout, and conversions that ended without result, as
+        failed."""
+
+        now = time.time()
+        for publish_file, (key, discovery_time, result, adjustments) in self._queued.items():
+            if result.ready() and not result.successful():
+                status, message = "failed", "Conversion of %s ended without result" % publish_file
+            elif now - discovery_time > self.timeout:
+                status, message = "timeout", "Conversion of %s did not finish in %d seconds" % (publish_file,
+                                                                                              self.timeout)
+            else:
+                continue
+            with self._lock:
+                if self._queued.pop(publish_file, None) is None:  # recorded by the result thread meanwhile
+                    continue
+            self.ledger.add(key, status, now - discovery_time)
+            self.logger.error(message)
+
+    def close(self):
+        """Wait until queued files have been converted, at most until their timeout, and stop the pool
+        processes."""
+
+        if self._pool is not None:
+            self._pool.close()
+            for publish_file, (key, discovery_time, result, adjustments) in self._queued.items():
+                result.wait(max(discovery_time + self.timeout - time.time(), 0))
+            self.expire()
+            if self._queued:
+                self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,53 @@
+import collections
+import logging
+import os
+
+from app import cache
+
+# result of a delta export: names of events written, skipped as unchanged and exported earlier but now gone
+DeltaResult = collections.namedtuple('DeltaResult', ['written', 'unchanged', 'removed'])
+
+
+class FingerprintStore(object):
+    """Fingerprints of the pricing events last exported for each adjustment oid.
+
+    Events are matched by content, not by name, so renumbered files with unchanged content are not
+    exported again."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.logger = logging.getLogger("delta")
+
+    def file_name(self, oid):
+        return os.path.join(self.directory, "%s.fingerprints" % oid)
+
+    def load(self, oid):
+        """Return fingerprint -> event name of the previous export of adjustment."""
+
+        return cache.read(self.file_name(oid), {})
+
+    def save(self, oid, fingerprints):
+        cache.write(self.file_name(oid), fingerprints)
+
+    def select(self, oid, events):
+        """Return DeltaResult with events that are new or changed since the previous export, events that
+        are unchanged and names of previously exported events that no longer exist."""
+
+        previous = self.load(oid)
+        current = set()
+        written, unchanged = [], []
+        for e in events:
+            current.add(e.fingerprint)
+            (unchanged if e.fingerprint in previous else written).append(e)
+
+        removed = sorted(name for fingerprint, name in previous.items() if fingerprint not in current)
+
+        self.logger.info("Adjustment %s: %d new or changed events, %d unchanged, %d removed" %
+                         (oid, len(written), len(unchanged), len(removed)))
+        for name in removed:
+            self.logger.warning("Adjustment %s: event %s of previous export no longer exists" % (oid, name))
+
+        return DeltaResult(written, unchanged, removed)
+
+    def update(self, oid, events):
+        self.save(oid, dict((e.fingerprint, e.name) for e in events))
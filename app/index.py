@@ -0,0 +1,179 @@
+import collections
+import logging
+import mmap
+import os
+
+from app import cache
+from app.parser import SplitParser
+
+
+class ItemIndex(object):
+    """Style code -> {variant code: color} lookup that reads only the rows of requested styles.
+
+    Index stores byte offsets of item information file rows per style code. Rows are parsed from a
+    memory mapped file when a style is requested and the most recently used styles are kept in memory.
+    Filtered rows are counted when the index is built."""
+
+    STYLE_FIELD = 3
+    VARIANT_FIELD = 0
+    COLOR_FIELD = 8
+    FILTER_FIELD = 11
+    FIELDS = 13
+
+    def __init__(self, item_file, cache_dir=None, cache_size=10000):
+        self.item_file = item_file
+        self.cache_size = cache_size
+        self.logger = logging.getLogger("index")
+
+        if cache_dir:
+            self.offsets, self.filtered = cache.load(os.path.join(cache_dir, 'item_offsets.cache'), item_file,
+                                                     self.build_offsets)
+        else:
+            self.offsets, self.filtered = self.build_offsets()
+
+        self._file = open(item_file, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets else None
+        self._styles = collections.OrderedDict()  # LRU cache: style code -> {variant code: color}
+
+    def build_offsets(self):
+        """Return style code -> list of byte offsets of the rows of that style and number of filtered rows."""
+
+        self.logger.info("Indexing item information file: %s" % self.item_file)
+        offsets = collections.defaultdict(list)
+        filtered = 0
+        position = 0
+        with open(self.item_file, 'rb') as f:
+            for line in f:
+                if line.count('|') != self.FIELDS - 1:
+                    self.check_fields(line.split('|'))
+                fields = line.split('|', self.FILTER_FIELD + 1)
+                offsets[fields[self.STYLE_FIELD]].append(position)
+                if fields[self.FILTER_FIELD] != '0':  # same filter as read_style
+                    filtered += 1
+                position += len(line)
+
+        self.logger.info("Indexed %d styles, %d filtered items" % (len(offsets), filtered))
+        return dict(offsets), filtered  # plain dict for marshal
+
+    @classmethod
+    def check_fields(cls, fields):
+        if len(fields) != cls.FIELDS:
+            raise TypeError("Item information row needs %d fields, got %d: %s" % (cls.FIELDS, len(fields), fields))
+
+    def get(self, style_code):
+        """Return {variant code: color} of the unfiltered variants of style (empty if style is unknown)."""
+
+        try:
+            variants = self._styles.pop(style_code)
+        except KeyError:
+            variants = self.read_style(style_code)
+            if len(self._styles) >= self.cache_size:
+                self._styles.popitem(last=False)  # drop least recently used style
+
+        self._styles[style_code] = variants
+        return variants
+
+    def read_style(self, style_code):
+        variants = {}
+        for offset in self.offsets.get(style_code, ()):
+            self._map.seek(offset)
+            fields = self._map.readline().split('|')
+            self.check_fields(fields)
+            if fields[self.FILTER_FIELD] == '0':  # same filter as full item information load
+                variants[fields[self.VARIANT_FIELD]] = fields[self.COLOR_FIELD]
+        return variants
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class ZoneIndex(object):
+    """Pricing zone -> stores index read from store information file.
+
+    Index is immutable and shared: every adjustment of every controller in the process uses the same
+    instance as long as the store information file does not change."""
+
+    STORE_FIELD = 0
+    ZONE_FIELD = 7
+    FIELDS = 11
+
+    _loaded = (None, None)  # (source file signature, ZoneIndex) of the store file loaded last
+
+    def __init__(self, zones):
+        self.zones = zones  # zone code -> frozenset of store codes
+
+        store_zones = collections.defaultdict(list)
+        for zone, stores in zones.items():
+            for store in stores:
+                store_zones[store].append(zone)
+        self.store_zones = dict((store, tuple(z)) for store, z in store_zones.items())  # store code -> zone codes
+
+        self.zone_order = dict((zone, i) for i, zone in enumerate(zones))  # zones are checked in dict order
+
+    def replace_stores_with_zones(self, location_set):
+        """Return location set where stores of every zone fully included in the set are replaced with the
+        zone code. Returns the same object if no zone was found.
+
+        Only zones of the stores in the set can be fully included. For sets with less than half as many
+        locations as there are zones just those zones are checked, otherwise every zone is checked (a failing
+        subset test is cheap)."""
+
+        if 2 * len(location_set) < len(self.zones):
+            candidates = set()
+            for location in location_set:
+                candidates.update(self.store_zones.get(location, ()))
+            zones = sorted(candidates, key=self.zone_order.__getitem__)
+        else:
+            zones = self.zones
+
+        remaining = location_set
+        replaced = []
+        for zone in zones:
+            stores = self.zones[zone]
+            if stores.issubset(remaining):
+                remaining = remaining - stores
+                replaced.append(zone)
+
+        if not replaced:
+            return location_set
+        return remaining.union(replaced)
+
+    @classmethod
+    def load(cls, store_file, cache_dir=None, parser=None):
+        """Return zone index of store_file. File is read once per process and, if cache_dir is given,
+        the index is stored there between runs. Only the index of the store file loaded last is kept, so
+        a new or changed store file releases the previous index. Parser splits the rows, str.split if not
+        given."""
+
+        signature = cache.source_signature(store_file)
+        loaded_signature, index = cls._loaded
+        if loaded_signature != signature:
+            if cache_dir:
+                zones = cache.load(os.path.join(cache_dir, 'zones.cache'), store_file,
+                                   lambda: cls.read_zones(store_file, parser))
+            else:
+                zones = cls.read_zones(store_file, parser)
+            index = cls(zones)
+            cls._loaded = signature, index  # replaces index of an older or differently named store file
+        return index
+
+    @classmethod
+    def read_zones(cls, store_file, parser=None):
+        logger = logging.getLogger("index")
+        logger.info("Loading store information from %s" % store_file)
+
+        zones = collections.defaultdict(set)
+        with open(store_file, 'r') as f:
+            for fields in (parser or SplitParser()).records(f):
+                if len(fields) != cls.FIELDS:
+                    raise TypeError("Store information row needs %d fields, got %d: %s" %
+                                    (cls.FIELDS, len(fields), fields))
+                zones[fields[cls.ZONE_FIELD]].add(fields[cls.STORE_FIELD])
+
+        logger.info("Loaded %d zones" % len(zones))
+        for k, v in sorted(zones.items()):
+            logger.debug("Zone %s has %d stores" % (k, len(v)))
+
+        return dict((zone, frozenset(stores)) for zone, stores in zones.items())
@@ -0,0 +1,60 @@
+import collections
+import logging
+import os
+import threading
+
+
+def file_key(file_name):
+    """Return key identifying the current version of a file: path, size and modification time."""
+
+    return "%s|%d|%r" % (os.path.abspath(file_name), os.path.getsize(file_name), os.path.getmtime(file_name))
+
+
+class Ledger(object):
+    """Durable record of publish file conversions. Every conversion of a file version (see file_key) is
+    recorded on its own line, and the line is flushed to disk before add returns, so a file converted before
+    a crash or restart is not converted again. Failed conversions are counted, so that a failing file can be
+    retried a limited number of times. A file that is uploaded again with new content has a new key."""
+
+    CONVERTED = "converted"
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.logger = logging.getLogger("ledger")
+        self._lock = threading.Lock()  # add is called from pool result threads
+        self._keys = set()  # converted file versions
+        self._failures = collections.Counter()  # file version -> failed conversions
+
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as f:
+                for line in f:
+                    key, status = line.rsplit('|', 2)[:2]  # key|status|seconds
+                    self._record(key, status)
+            self.logger.info("Loaded %d converted files from ledger %s" % (len(self._keys), file_name))
+
+    def __contains__(self, key):
+        """True if the file version has been converted successfully."""
+
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def failures(self, key):
+        """Return number of failed conversions of the file version."""
+
+        return self._failures[key]
+
+    def _record(self, key, status):
+        if status == self.CONVERTED:
+            self._keys.add(key)
+        else:
+            self._failures[key] += 1
+
+    def add(self, key, status, seconds):
+        with self._lock:
+            with open(self.file_name, 'a') as f:
+                f.write("%s|%s|%.3f\n" % (key, status, seconds))
+                f.flush()
+                os.fsync(f.fileno())
+            self._record(key, status)
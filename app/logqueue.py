@@ -0,0 +1,103 @@
+import atexit
+import logging
+import multiprocessing.util
+import os
+import Queue
+import threading
+
+_file_handlers = {}  # log file path -> QueueHandler writing to it
+
+
+class QueueListener(object):
+    """Background thread passing log records from a queue to handlers."""
+
+    _STOP = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self.pid = os.getpid()
+        self._thread = None
+
+    @property
+    def running(self):
+        """True if records put to the queue are handled, i.e. the thread runs in this process (not in a
+        process forked after the thread was started)."""
+
+        return self._thread is not None and self.pid == os.getpid()
+
+    def start(self):
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._monitor, name="log-listener")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                break
+            self.handle(record)
+
+    def stop(self):
+        """Handle records still in the queue and stop the thread."""
+
+        if self.running:
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+            for handler in self.handlers:
+                handler.flush()
+
+
+class QueueHandler(logging.Handler):
+    """Handler putting log records to the queue of a QueueListener, so that a slow handler (e.g. a file on a
+    network drive) does not block the logging thread. The message is formatted before the record is queued,
+    as its arguments may change before the listener handles it. In a forked process, where the listener
+    thread does not run, records are handled directly."""
+
+    def __init__(self, listener):
+        logging.Handler.__init__(self)
+        self.listener = listener
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            if self.listener.running:
+                self.listener.queue.put_nowait(self.prepare(record))
+            else:
+                self.listener.handle(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+def queued_file_handler(file_name, formatter):
+    """Return handler writing to log file file_name through a queue. Handler is shared by every logger
+    writing to the file, and the queue is emptied when the process exits. A forked process inherits the
+    handler of its parent and writes directly."""
+
+    path = os.path.abspath(file_name)
+    handler = _file_handlers.get(path)
+    if handler is None:
+        fh = logging.FileHandler(file_name)
+        fh.setFormatter(formatter)
+        listener = QueueListener(Queue.Queue(), fh)
+        listener.start()
+        atexit.register(listener.stop)
+        multiprocessing.util.Finalize(None, listener.stop, exitpriority=0)  # multiprocessing children skip atexit
+        handler = _file_handlers[path] = QueueHandler(listener)
+    return handler
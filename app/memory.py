@@ -0,0 +1,141 @@
+import collections
+import gc
+import logging
+import os
+
+try:
+    import tracemalloc  # Python 3.4+, or pytracemalloc on a patched Python 2
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def resident_memory():
+    """Return resident set size of this process in bytes, 0 if it cannot be read."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, ValueError, OSError, AttributeError):
+        return 0
+
+
+def peak_resident_memory():
+    """Return highest resident set size of this process so far in bytes, 0 if not available."""
+
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname()[0] == "Darwin" else peak * 1024  # kilobytes on Linux
+
+
+def object_counts():
+    """Return type name -> number of objects tracked by the garbage collector (containers only)."""
+
+    return collections.Counter(type(o).__name__ for o in gc.get_objects())
+
+
+class MemoryProfiler(object):
+    """Memory used by each stage of a RunReport, attached with RunReport(profiler).
+
+    With tracemalloc, memory is traced Python allocations and allocation sites are source lines with the
+    bytes they retained. Without it, memory is the resident set size of the process and allocation sites are
+    object types with the number of objects retained (gc tracked containers only, so strings are not
+    counted). Like stage times, retained memory is exclusive of inner stages. Peak is the highest memory
+    reached during the stage above the memory at its start; without tracemalloc.reset_peak only a stage
+    that raises the process high water mark has a peak."""
+
+    TOP_SITES = 10
+
+    def __init__(self, use_tracemalloc=True):
+        self.tracing = tracemalloc is not None and use_tracemalloc
+        if self.tracing and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.stages = collections.OrderedDict()  # stage -> totals, in order of first appearance
+        self._running = []  # [memory at start, peak at start, retained by inner stages] of running stages
+        self._snapshot = self.take_snapshot()
+
+    @property
+    def method(self):
+        return "tracemalloc" if self.tracing else "rss+gc"
+
+    @property
+    def unit(self):
+        return "bytes" if self.tracing else "objects"
+
+    def memory(self):
+        """Return current and peak memory in bytes."""
+
+        if self.tracing:
+            return tracemalloc.get_traced_memory()
+        return resident_memory(), peak_resident_memory()
+
+    def take_snapshot(self):
+        if self.tracing:
+            return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                              tracemalloc.Filter(False, __file__)])
+        return object_counts()
+
+    def sites(self, snapshot, previous):
+        """Return allocation site -> memory retained between previous and snapshot."""
+
+        if self.tracing:
+            return collections.Counter(dict((str(stat.traceback[0]), stat.size_diff)
+                                            for stat in snapshot.compare_to(previous, 'lineno') if stat.size_diff))
+        sites = collections.Counter(snapshot)
+        sites.subtract(previous)
+        return sites
+
+    def stage_started(self):
+        if self.tracing and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        current, peak = self.memory()
+        self._running.append([current, peak, 0])
+
+    def stage_finished(self, stage):
+        start_memory, start_peak, inner = self._running.pop()
+        current, peak = self.memory()
+        retained = current - start_memory
+        if self._running:
+            self._running[-1][2] += retained
+
+        snapshot = self.take_snapshot()
+        sites = self.sites(snapshot, self._snapshot)
+        self._snapshot = snapshot
+
+        if self.tracing and hasattr(tracemalloc, "reset_peak"):
+            stage_peak = peak - start_memory
+        else:
+            stage_peak = max(peak - start_peak, 0)
+
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = {"count": 0, "retained": 0, "peak": 0, "sites": collections.Counter()}
+        totals["count"] += 1
+        totals["retained"] += retained - inner
+        totals["peak"] = max(totals["peak"], stage_peak)
+        totals["sites"].update(sites)
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "stages": collections.OrderedDict(
+                (stage, {"count": t["count"], "retained_bytes": t["retained"], "peak_bytes": t["peak"],
+                         "top_sites": [[site, n] for site, n in t["sites"].most_common(self.TOP_SITES) if n > 0],
+                         "site_unit": self.unit})
+                for stage, t in self.stages.items()),
+        }
+
+    def log_summary(self, logger=None):
+        logger = logger or logging.getLogger("memory")
+        logger.info("Memory by stage (%s): retained MB, peak MB, runs" % self.method)
+        for stage, t in sorted(self.stages.items(), key=lambda (stage, t): -t["peak"]):
+            logger.info("  %-22s %9.1f %9.1f %6d" % (stage, t["retained"] / 1048576.0, t["peak"] / 1048576.0,
+                                                    t["count"]))
+            for site, n in t["sites"].most_common(3):
+                if n > 0:
+                    logger.info("      %s: %d %s" % (site, n, self.unit))
@@ -0,0 +1,54 @@
+import csv
+
+
+class SplitParser(object):
+    """Splits pipe delimited lines into field lists with str.split. Trailing whitespace (the line feed)
+    of each line is removed.
+
+    Records are produced one at a time from the buffered file iterator: collecting lines or field lists
+    into large blocks first was measured to be slower (see benchmark.py parser)."""
+
+    DELIMITER = "|"
+
+    def records(self, f):
+        """Return iterator of the field lists of the lines of file f."""
+
+        delimiter = self.DELIMITER
+        return (line.rstrip().split(delimiter) for line in f)
+
+
+class PipeDialect(csv.Dialect):
+    """Pricer and JDA files: pipe delimited, no quoting."""
+
+    delimiter = "|"
+    quoting = csv.QUOTE_NONE
+    escapechar = None
+    doublequote = False
+    skipinitialspace = False
+    lineterminator = "\n"
+    strict = False
+
+
+class CsvParser(SplitParser):
+    """Splits lines with the C implemented csv reader. Field lists are the same as with SplitParser."""
+
+    def records(self, f):
+        for fields in csv.reader(f, PipeDialect):
+            if fields:
+                fields[-1] = fields[-1].rstrip()
+            else:
+                fields.append("")  # empty line
+            yield fields
+
+
+PARSERS = {
+    "split": SplitParser,
+    "csv": CsvParser,
+}
+
+
+def get_parser(name):
+    try:
+        return PARSERS[name]()
+    except KeyError:
+        raise ValueError("Unknown parser %s, valid parsers are: %s" % (name, ", ".join(sorted(PARSERS))))
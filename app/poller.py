@@ -1,13 +1,19 @@
+import glob
 import logging
 import os
 import time
 import subprocess
 import datetime
 
+from app.controller import ExportController
+from app.conversion_pool import ConversionPool
+from app.watcher import WATCH_MODES, create_watcher
+
 class Poller(object):
     FILE_DOES_NOT_EXIST = -1
     FILES_NOT_READY = 0
     FILES_COMPLETE = 1
+    CONVERSIONS = ("script", "in_process", "pool")
 
     def __init__(self, property_file='/Users/jaska/Work/JDA_Guess/test/Guess.properties'):
 
@@ -36,10 +42,50 @@ class Poller(object):
         self.start_time = datetime.time(self.start_time.tm_hour, self.start_time.tm_min)
         self.duration = int(cfg.get("POLLER", "duration"))
 
+        # poll: check status file every sleep_time seconds, inotify: check as soon as the file is written,
+        # auto: inotify where available
+        self.watch_mode = cfg.get("POLLER", "watch_mode") if cfg.has_option("POLLER", "watch_mode") else "poll"
+        if self.watch_mode not in WATCH_MODES:
+            raise SystemExit("Invalid watch_mode %s in %s" % (self.watch_mode, property_file))
+        self.watcher = None
+
+        # script: run script for every upload, in_process: convert newest publish_files match with a controller
+        # kept in memory (item and store information stay loaded) and keep watching for the next upload,
+        # pool: convert every new publish_files match in publish_workers processes, independent of status_file
+        self.conversion = cfg.get("POLLER", "conversion") if cfg.has_option("POLLER", "conversion") else "script"
+        if self.conversion not in self.CONVERSIONS:
+            raise SystemExit("Invalid conversion %s in %s" % (self.conversion, property_file))
+        self.publish_files = cfg.get("POLLER", "publish_files") if cfg.has_option("POLLER", "publish_files") else None
+        if self.conversion in ("in_process", "pool") and not self.publish_files:
+            raise SystemExit("Conversion %s needs publish_files: %s" % (self.conversion, property_file))
+        self.property_file = property_file
+        self._controller = None
+
+        self.conversion_pool = None
+        self.settle_wait = None  # seconds until a publish file still being written can be queued
+        if self.conversion == "pool":
+            if not cfg.has_option("POLLER", "ledger_file"):
+                raise SystemExit("Conversion pool needs ledger_file: %s" % property_file)
+            self.conversion_pool = ConversionPool(
+                property_file, self.publish_files, cfg.get("POLLER", "ledger_file"),
+                cfg.getint("POLLER", "publish_workers") if cfg.has_option("POLLER", "publish_workers") else 2,
+                cfg.getint("POLLER", "settle_time") if cfg.has_option("POLLER", "settle_time") else 2,
+                cfg.getint("POLLER", "publish_retries") if cfg.has_option("POLLER", "publish_retries") else 2,
+                cfg.getint("POLLER", "conversion_timeout") if cfg.has_option("POLLER", "conversion_timeout") else 3600)
+
+    @property
+    def watched_file(self):
+        return self.publish_files if self.conversion == "pool" else self.filename
+
+    @property
+    def end_time(self):
+        return datetime.datetime.combine(datetime.datetime.today(), self.start_time) + \
+               datetime.timedelta(hours=self.duration)
+
     @property
     def is_active(self):
         start_time = datetime.datetime.combine(datetime.datetime.today(), self.start_time)
-        end_time = start_time + datetime.timedelta(hours=self.duration)
+        end_time = self.end_time
         now = datetime.datetime.now()
         logging.debug("Start time: %s" % self.start_time)
         logging.debug("End time: %s (duration: %s hours)" % (end_time, self.duration))
@@ -83,23 +129,85 @@ class Poller(object):
             my_scheduler.run()
 
         if self.is_active:
-            logging.info("Poller is active, monitoring file: %s" % self.filename)
+            logging.info("Poller is active, monitoring file: %s" % self.watched_file)
+
+            if self.watch_mode != "poll" and self.watcher is None:  # watch before polling to catch every change
+                self.watcher = create_watcher(self.watched_file, self.watch_mode)
+
+            if self.conversion == "pool":
+                self.settle_wait = self.conversion_pool.discover()
+                self.schedule_next_check(my_scheduler)
+                return
 
             rv = self.poll()
             logging.debug("Poll returned value %d" % rv)
             if rv == self.FILES_COMPLETE:
                 logging.info("Guess file upload complete -> start pricer import")
-                self.run_script()
+                if self.conversion == "in_process":
+                    self.run_conversion()
+                else:
+                    self.run_script()
                 with open(self.import_status_file, 'a') as f:
                     f.write("Import script finished at %s" % time.asctime( time.localtime(time.time())))
+                if self.conversion == "in_process":  # controller stays warm for the next upload
+                    self.schedule_next_check(my_scheduler)
             else:
-                logging.info("Poller sleeping for %d seconds" % self.sleep_time)
-
-                my_scheduler.enter(self.sleep_time, 0, self.run, [my_scheduler])
+                self.schedule_next_check(my_scheduler)
         else:
             logging.info("Poller not active, next round at %s" % self.next_run_time)
             my_scheduler.enterabs(time.mktime(self.next_run_time.timetuple()), 0, self.run, [my_scheduler])
 
+    def schedule_next_check(self, my_scheduler):
+        if self.watch_mode == "poll":
+            sleep_time = min(self.sleep_time, self.settle_wait) if self.settle_wait is not None else self.sleep_time
+            logging.info("Poller sleeping for %d seconds" % sleep_time)
+
+            my_scheduler.enter(sleep_time, 0, self.run, [my_scheduler])
+        else:
+            self.wait_for_change()
+            my_scheduler.enter(0, 0, self.run, [my_scheduler])
+
+    def wait_for_change(self):
+        """Wait until the watched file is written, sleep_time seconds pass, a publish file still being written
+        settles or the active period ends."""
+
+        timeout = min(self.sleep_time, max((self.end_time - datetime.datetime.now()).total_seconds(), 0))
+        if self.settle_wait is not None:
+            timeout = min(timeout, self.settle_wait)
+        logging.info("Poller waiting at most %d seconds for changes of %s" % (timeout, self.watched_file))
+        if self.watcher.wait(timeout):
+            logging.info("Watched file %s changed" % self.watched_file)
+
+    @property
+    def controller(self):
+        if self._controller is None:
+            self._controller = ExportController(self.property_file)
+        return self._controller
+
+    def run_conversion(self):
+        """Convert the newest publish file in this process. Return conversion time in seconds, None if
+        there was nothing to convert or the conversion failed."""
+
+        try:
+            publish_file = max(glob.iglob(self.publish_files), key=os.path.getctime)
+        except ValueError:
+            logging.error("Cannot find any publish files: %s" % self.publish_files)
+            return None
+
+        logging.info("Converting %s in process" % publish_file)
+        start_time = time.time()
+        try:
+            self.controller.reset()
+            self.controller.process_file(publish_file)
+        except (Exception, SystemExit), e:  # keep the poller running for the next upload
+            logging.error("Error in processing publish file %s: %s" % (publish_file, e))
+            return None
+
+        elapsed = time.time() - start_time
+        logging.info("Conversion latency: %.3f s (%.3f s after status file update)" %
+                     (elapsed, time.time() - os.path.getmtime(self.filename)))
+        return elapsed
+
     def run_script(self):
         logging.info("Running command/script: %s" % self.script)
         start_time = time.time()
@@ -116,4 +224,7 @@ if __name__ == '__main__':
     try:
         p.run()
     except KeyboardInterrupt:
-        logging.info("Interrupted by user.")
\ No newline at end of file
+        logging.info("Interrupted by user.")
+    finally:
+        if p.conversion_pool is not None:
+            p.conversion_pool.close()
\ No newline at end of file
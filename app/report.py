@@ -0,0 +1,91 @@
+import collections
+import contextlib
+import datetime
+import json
+import os
+import time
+from timeit import default_timer as timer
+
+from app import cache
+
+
+class RunReport(object):
+    """Stage timings and counters of a conversion run, written as JSON.
+
+    Stage times are exclusive: time of a stage started while another one is running (e.g. loading item
+    information while the first item price is parsed) is counted only for the inner stage. Reports of export
+    worker processes are merged into the controller's report. With a profiler (see app.memory.MemoryProfiler),
+    memory used by each stage is measured too."""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.started = time.time()
+        self.stages = collections.defaultdict(float)  # stage -> seconds
+        self.stage_counts = collections.defaultdict(int)  # stage -> times run
+        self.counters = collections.defaultdict(int)
+        self._nested = []  # time spent in inner stages of each running stage
+
+    def start(self):
+        """Start timing a stage. Return value is given to stop()."""
+
+        self._nested.append(0.0)
+        if self.profiler:
+            self.profiler.stage_started()
+        return timer()
+
+    def stop(self, stage, start_time):
+        elapsed = timer() - start_time
+        self.stages[stage] += elapsed - self._nested.pop()
+        self.stage_counts[stage] += 1
+        if self._nested:
+            self._nested[-1] += elapsed
+        if self.profiler:
+            self.profiler.stage_finished(stage)
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start_time = self.start()
+        try:
+            yield
+        finally:
+            self.stop(stage, start_time)
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def merge(self, other):
+        for stage, seconds in other.stages.items():
+            self.stages[stage] += seconds
+            self.stage_counts[stage] += other.stage_counts[stage]
+        for counter, n in other.counters.items():
+            self.counters[counter] += n
+
+    def as_dict(self, **info):
+        """Return report as JSON serializable dictionary with info items added."""
+
+        seconds = time.time() - self.started
+        records = sum(n for counter, n in self.counters.items() if counter.startswith("records."))
+        rv = dict(info)
+        rv.update({
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(),
+            "seconds": round(seconds, 3),
+            "records_per_second": round(records / seconds, 1) if seconds > 0 else None,
+            "stages": dict((stage, {"seconds": round(s, 6), "count": self.stage_counts[stage]})
+                           for stage, s in self.stages.items()),
+            "counters": dict(self.counters),
+        })
+        if self.profiler:
+            rv["memory"] = self.profiler.as_dict()
+        return rv
+
+    def write(self, file_name, **info):
+        """Write report to file_name. File is written to a temporary name first and renamed when complete."""
+
+        temp_file = cache.temp_name(file_name)
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(self.as_dict(**info), f, indent=2, sort_keys=True)
+            cache.replace(temp_file, file_name)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
@@ -0,0 +1,106 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import time
+
+WATCH_MODES = ("auto", "inotify", "poll")
+
+
+class PollingWatcher(object):
+    """Waits for the given time without seeing changes: the caller checks the file after every wait."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def wait(self, timeout):
+        """Wait at most timeout seconds for a change of the watched file. Return True if a change was seen,
+        False on timeout."""
+
+        time.sleep(max(timeout, 0))
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Watches a file with Linux inotify through ctypes. The directory of the file is watched, so the file
+    may be created, replaced or renamed into place after the watch starts. The file name may be a glob
+    pattern, e.g. publish*.txt, to watch every matching file of the directory."""
+
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO  # file written and closed, moved into place or touched
+
+    EVENT_HEADER = struct.Struct("iIII")  # struct inotify_event: wd, mask, cookie, len, then name
+
+    _libc = None
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        directory = os.path.dirname(os.path.abspath(path))
+
+        libc = self.libc()
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed: %s" % os.strerror(ctypes.get_errno()))
+        if libc.inotify_add_watch(self.fd, directory, self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "Cannot watch %s: %s" % (directory, os.strerror(errno)))
+
+    @classmethod
+    def libc(cls):
+        if cls._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            if not hasattr(libc, "inotify_init"):
+                raise OSError("C library has no inotify support")
+            cls._libc = libc
+        return cls._libc
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], max(deadline - time.time(), 0))
+            if not readable:
+                return False
+            if fnmatch.filter(self.read_names(), self.name):
+                return True
+
+    def read_names(self):
+        """Return names of the files of pending events."""
+
+        data = os.read(self.fd, 65536)
+        names = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            names.append(data[offset:offset + length].rstrip("\0"))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(path, mode="poll"):
+    """Return watcher of path. Mode is poll, inotify or auto (inotify where available, polling otherwise).
+    Falls back to polling if inotify cannot watch the file."""
+
+    if mode not in WATCH_MODES:
+        raise ValueError("Unknown watch mode %s, valid modes are: %s" % (mode, ", ".join(WATCH_MODES)))
+
+    if mode != "poll":
+        try:
+            return InotifyWatcher(path)
+        except OSError, e:
+            logging.getLogger("watcher").warning("Cannot watch %s with inotify, polling instead: %s" % (path, e))
+
+    return PollingWatcher(path)
@@ -0,0 +1,50 @@
+import logging
+import Queue
+import sys
+import threading
+
+
+class EventWriter(object):
+    """Writes pricing event files in a pool of threads. Events wait in a bounded queue, so a producer
+    creating events faster than they can be written is blocked instead of filling the memory."""
+
+    def __init__(self, threads, queue_size=None):
+        self.logger = logging.getLogger("writer")
+        self.queue = Queue.Queue(queue_size or 2 * threads)
+        self.errors = []  # exc_info of failed writes
+        self.sizes = []  # bytes written per file
+
+        self.threads = [threading.Thread(target=self.run, name="EventWriter-%d" % i) for i in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                if event is None:  # close() was called
+                    return
+                self.sizes.append(event.export_tab_delimited())
+            except Exception:
+                self.logger.error("Writing MMS file %s failed: %s", event.filename, sys.exc_info()[1])
+                self.errors.append(sys.exc_info())
+            finally:
+                self.queue.task_done()
+
+    def write(self, event):
+        self.queue.put(event)
+
+    def close(self):
+        """Wait until all events are written. Raises the first error of a failed write, otherwise returns
+        number of bytes written."""
+
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+        if self.errors:
+            exc_type, exc_value, exc_traceback = self.errors[0]
+            raise exc_type, exc_value, exc_traceback
+        return sum(self.sizes)
@@ -0,0 +1,660 @@
+"""Performance benchmarks for the MMS conversion.
+
+Run from the project root, e.g.:
+
+    python test/benchmark.py dispatch 1000000
+"""
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import random
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.adjustment import Adjustment, AdjustmentParameters, AdjustmentSchedule, ItemPrice, PricingEvent, \
+    format_rows
+from app.index import ZoneIndex
+from app.parser import SplitParser, CsvParser
+from generator import generate
+from app.controller import ExportController
+from app.conversion_pool import ConversionPool
+
+HEADER_LINES = """A|A25E3EE9AFA248A79DF07D2565410784||Benchmark adjustment||Promotion % Off
+D|Pen|Benchmark|
+S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1
+U|H|I||All
+C|H|I||All|
+L|H|I|LUSA|USA|
+V|PriceCode|2|
+V|EventType|A|
+V|ReasonCode|A|
+V|Country|USA|
+V|DataType||
+V|BasedOn|2|
+V|OverrideAll||
+LB|5012|100|R
+LB|5501|100|R""".split("\n")
+
+ITEM_LINE = "I||||||LUSA-100|100|%s|2016-06-01|2016-06-30|1|%s|||%d.99|USD"
+
+
+class LegacyExportController(ExportController):
+    """Controller with the original exec based record dispatch, used as the baseline."""
+
+    def process_line(self, line):
+        fields = line.split("|")
+        type = self.DATA_TYPES.get(fields[0])
+        if type:
+            exec "self.%s(%s)" % (type, fields[1:])
+        else:
+            raise Exception("Invalid data type on line: %s" % line)
+
+
+def write_properties(workdir):
+    property_file = os.path.join(workdir, 'Guess.properties')
+    with open(property_file, 'w') as f:
+        f.write("[MMS]\n")
+        f.write("input_dir = %s\n" % workdir)
+        f.write("output_dir = %s\n" % workdir)
+        f.write("log_level = WARNING\n")
+        f.write("log_file = %s\n" % os.path.join(workdir, 'mms_conversion.log'))
+    return property_file
+
+
+def write_publish_file(workdir, item_rows):
+    """Write publish file with one adjustment and item_rows item price rows. Styles are not found from
+    the item master so the rows exercise parsing and dispatch instead of style expansion."""
+
+    publish_file = os.path.join(workdir, 'publish.txt')
+    stores = ["5012", "5501"]
+    with open(publish_file, 'w') as f:
+        f.write("\n".join(HEADER_LINES) + "\n")
+        for i in xrange(item_rows):
+            f.write(ITEM_LINE % (stores[i % 2], "BENCH%05d" % (i % 5000), i % 100) + "\n")
+    return publish_file
+
+
+def create_controller(controller_class, property_file):
+    c = controller_class(property_file)
+    c._item_info_file = os.path.join('test', 'item_info.txt')
+    c._store_info_file = os.path.join('test', 'store_info.txt')
+    return c
+
+
+def time_lines(controller_class, property_file, publish_file):
+    c = create_controller(controller_class, property_file)
+    with open(publish_file, 'r') as f:
+        lines = [line.rstrip() for line in f]
+
+    start = time.time()
+    for line in lines:
+        c.process_line(line)
+    elapsed = time.time() - start
+    return len(lines), elapsed
+
+
+def benchmark_dispatch(item_rows=1000000):
+    workdir = tempfile.mkdtemp()
+    try:
+        property_file = write_properties(workdir)
+        publish_file = write_publish_file(workdir, item_rows)
+
+        for label, controller_class in (("exec (before)", LegacyExportController),
+                                        ("handler table (after)", ExportController)):
+            lines, elapsed = time_lines(controller_class, property_file, publish_file)
+            print "%-22s %9d lines %8.2f s %12.0f lines/s" % (label, lines, elapsed, lines / elapsed)
+    finally:
+        shutil.rmtree(workdir)
+
+
+class LegacyLocationCheckController(ExportController):
+    """Controller that also runs the original list based location check for every item price."""
+
+    def add_item_price(self, fields):
+        a = self.current_adjustment
+        if fields[7] and not fields[7] in a.location_business.keys() + list(a.zone_sets):
+            raise Exception("Location business %s not found for item price: %s" % (fields[7], fields))
+        ExportController.add_item_price(self, fields)
+
+
+def benchmark_location_check(max_stores=1000, max_rows=200000):
+    """Time item price rows with list scan and set lookup location check, scaling store count and row
+    count separately."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        property_file = write_properties(workdir)
+        scales = [(stores, max_rows) for stores in (10, max_stores // 10, max_stores)] + \
+                 [(max_stores, rows) for rows in (max_rows // 100, max_rows // 10)]
+
+        for stores, rows in scales:
+            store_ids = [str(10000 + i) for i in xrange(stores)]
+            lines = [HEADER_LINES[0]] + ["LB|%s|100|R" % store for store in store_ids] + \
+                    [ITEM_LINE % (store_ids[i % stores], "BENCH%05d" % (i % 5000), i % 100) for i in xrange(rows)]
+
+            for label, controller_class in (("list scan", LegacyLocationCheckController),
+                                            ("set lookup", ExportController)):
+                c = create_controller(controller_class, property_file)
+                start = time.time()
+                for line in lines:
+                    c.process_line(line)
+                elapsed = time.time() - start
+                print "%-10s %6d stores %8d rows %8.2f s" % (label, stores, rows, elapsed)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def write_item_file(workdir, styles, colors_per_style=5):
+    item_file = os.path.join(workdir, 'JDA_Item_benchmark.txt')
+    with open(item_file, 'w') as f:
+        variant = 10000000
+        for style in xrange(styles):
+            for color in xrange(colors_per_style):
+                variant += 1
+                f.write("%d|BENCH ITEM|A|BENCH%06d|3|10|115|115|C%02d|30||0|\n" % (variant, style, color))
+    return item_file
+
+
+def benchmark_item_lookup(styles=200000, lookups=2000):
+    """Time first lookup of a small adjustment's styles with full item load and with the offset index."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        property_file = write_properties(workdir)
+        item_file = write_item_file(workdir, styles)
+        wanted = ["BENCH%06d" % (i * (styles // lookups)) for i in xrange(lookups)]
+
+        for item_lookup in ("memory", "index"):
+            c = ExportController(property_file)
+            c._item_info_file = item_file
+            c.item_lookup = item_lookup
+            start = time.time()
+            [c.get_color_codes_for_style(style) for style in wanted]
+            print "%-7s %8d styles in file %6d lookups %8.3f s" % (item_lookup, styles, lookups, time.time() - start)
+    finally:
+        shutil.rmtree(workdir)
+
+
+class LegacyItemPriceList(list):
+    """Original item price storage: one ItemPrice object per row."""
+
+    def append(self, fields):
+        list.append(self, ItemPrice(*fields))
+        return len(self) - 1
+
+    def __setitem__(self, index, fields):
+        list.__setitem__(self, index, ItemPrice(*fields))
+
+
+def split_lines(f):
+    """Original parsing: iterate the file and split each line."""
+
+    return (line.rstrip().split('|') for line in f)
+
+
+def write_store_file(workdir, stores, zones=100):
+    store_file = os.path.join(workdir, 'JDA_Store_benchmark.txt')
+    with open(store_file, 'w') as f:
+        for store in xrange(stores):
+            f.write("%d|BENCH STORE|A|1|2|3|4|Z%03d|5|6|\n" % (10000 + store, store % zones))
+    return store_file
+
+
+def benchmark_parser(rows=500000):
+    """Time splitting publish, item information and store information rows with the original line loop
+    and the parsers."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        files = (("publish", write_publish_file(workdir, rows)),
+                 ("item information", write_item_file(workdir, rows // 5)),
+                 ("store information", write_store_file(workdir, rows // 10)))
+        for label, file_name in files:
+            with open(file_name, 'r') as f:
+                expected = list(split_lines(f))
+            for parser_label, records in (("split per line", split_lines),
+                                          ("split parser", SplitParser().records),
+                                          ("csv parser", CsvParser().records)):
+                with open(file_name, 'r') as f:
+                    assert list(records(f)) == expected
+                elapsed = []
+                for repeat in xrange(3):
+                    start = time.time()
+                    with open(file_name, 'r') as f:
+                        for fields in records(f):  # consumed one at a time like the controller does
+                            pass
+                    elapsed.append(time.time() - start)
+                print "%-18s %-15s %8d rows %7.3f s (best of 3)" % (label, parser_label, len(expected), min(elapsed))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def resident_memory():
+    """Return resident set size of this process in bytes (Linux) or peak RSS elsewhere."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_style_publish_file(workdir, stores, styles, colors_per_style=5):
+    """Publish file where every store has a style price for every style, prices differ by store group and
+    every 10th variant has a variant price."""
+
+    publish_file = os.path.join(workdir, 'publish_styles.txt')
+    with open(publish_file, 'w') as f:
+        f.write(HEADER_LINES[0] + "\n")
+        f.write("\n".join(HEADER_LINES[2:13]) + "\n")
+        for store in xrange(stores):
+            f.write("LB|%d|100|R\n" % (10000 + store))
+        for store in xrange(stores):
+            for style in xrange(styles):
+                f.write(ITEM_LINE % (10000 + store, "BENCH%06d" % style, (store % 7) * 10 + style % 3) + "\n")
+                variant = 10000001 + style * colors_per_style
+                if style % 10 == 0:
+                    f.write("I||||||LUSA-100|100|%d|2016-06-01|2016-06-30|1|BENCH%06d||%d|9.99|USD\n" %
+                            (10000 + store, style, variant))
+    return publish_file
+
+
+class EagerExpansionController(ExportController):
+    """Controller with the original style price handling: a row per color variant, replaced by variant prices."""
+
+    def add_item_price(self, fields):
+        a = self.current_adjustment
+        location_id = fields[7] or fields[6]
+        fields[7] = location_id
+        codes = self.get_color_codes_for_style(fields[11])
+        if fields[13] == '':
+            for variant_code, variant_color in codes.items():
+                fields[12], fields[13] = variant_color, variant_code
+                self.item_price_map["%s|%s" % (location_id, variant_code)] = a.item_price.append(fields)
+        else:
+            try:
+                fields[12] = codes[fields[13]]
+                a.item_price[self.item_price_map["%s|%s" % (location_id, fields[13])]] = fields
+            except KeyError:
+                pass
+
+
+def measure_item_memory(property_file, item_file, publish_file, controller_class, legacy, results):
+    c = controller_class(property_file)
+    c._item_info_file = item_file
+    c._store_info_file = os.path.join('test', 'store_info.txt')
+    c.style_to_variant_map  # load item information before measuring
+
+    with open(publish_file, 'r') as f:
+        lines = [line.rstrip() for line in f]
+
+    before = resident_memory()
+    start = time.time()
+    for line in lines:
+        c.process_line(line)
+        if legacy and line.startswith("A|"):
+            c.current_adjustment.item_price = LegacyItemPriceList()
+    parsed = time.time()
+    used = resident_memory() - before
+    if legacy:
+        results.put((len(c.current_adjustment.item_price), used, parsed - start, None))
+        return
+    c.current_adjustment.get_pricing_events()
+    results.put((len(c.current_adjustment.item_price), used, parsed - start, time.time() - parsed))
+
+
+def benchmark_item_memory(stores=200, styles=2000):
+    """Compare memory used by item prices of one adjustment stored as ItemPrice objects, as columns with a
+    row per color variant and as columns with a row per style price (expanded in get_pricing_events)."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        property_file = write_properties(workdir)
+        item_file = write_item_file(workdir, styles)
+        publish_file = write_style_publish_file(workdir, stores, styles)
+
+        for label, controller_class, legacy in (("ItemPrice objects", EagerExpansionController, True),
+                                                ("columns", EagerExpansionController, False),
+                                                ("style rows", ExportController, False)):
+            results = multiprocessing.Queue()
+            p = multiprocessing.Process(target=measure_item_memory,
+                                        args=(property_file, item_file, publish_file, controller_class, legacy,
+                                              results))
+            p.start()
+            rows, used, parse_seconds, event_seconds = results.get()
+            p.join()
+            print "%-18s %9d item prices %8.1f MB  parse %6.2f s  events %s" % \
+                  (label, rows, used / 1024.0 / 1024.0, parse_seconds,
+                   "%6.2f s" % event_seconds if event_seconds is not None else "-")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def build_grouped_adjustment(groups, stores=2000, zones=100, items_per_group=3, max_group_stores=60, seed=1):
+    """Return adjustment whose item prices form about the given number of distinct location groups."""
+
+    rnd = random.Random(seed)
+    store_ids = [str(10000 + i) for i in xrange(stores)]
+    zone_stores = collections.defaultdict(set)
+    for i, store in enumerate(store_ids):
+        zone_stores["Z%03d" % (i % zones)].add(store)
+
+    a = Adjustment("BENCH", "", "Benchmark", "", "")
+    a.schedule = AdjustmentSchedule(*"2016-06-01|2016-06-30|||1|1|1|1|1|1|1".split("|"))
+    for line in HEADER_LINES[6:13]:
+        fields = line.split("|")[1:]
+        a.parameters[fields[0]] = AdjustmentParameters(*fields)
+    a.zone_index = ZoneIndex(dict((zone, frozenset(s)) for zone, s in zone_stores.items()))
+
+    for group in xrange(groups):
+        locations = rnd.sample(store_ids, rnd.randint(1, max_group_stores))
+        for item in xrange(items_per_group):
+            for location in locations:
+                a.item_price.append(("", "", "", "", "", "LUSA", "USA", location, "2016-06-01", "2016-06-30", "1",
+                                     "G%05d" % group, "C%d" % item, "", "%d.99" % item, "USD"))
+    return a
+
+
+def legacy_pricing_events(a):
+    """Original grouping with str(sorted(set)) keys and eval()."""
+
+    a.validate()
+    d = collections.defaultdict(set)
+    [d[item].add(location) for location, item in a.item_price.location_items()]
+    d2 = collections.defaultdict(list)
+    [d2[str(sorted(v))].append(k) for k, v in d.items()]
+    from operator import attrgetter
+    for k, v in d2.items():
+        d2[k] = sorted(v, key=attrgetter('item_style_code', 'item_color'))
+    for location_list in d2.keys():
+        use_zones = False
+        location_set = set(eval(location_list))
+        for zone in a.zone_sets:
+            if a.zone_sets[zone].issubset(location_set):
+                use_zones = True
+                location_set = location_set - a.zone_sets[zone]
+                location_set.add(zone)
+        if use_zones:
+            d2[str(sorted(list(location_set)))] = d2.pop(location_list)
+    pricing_events = []
+    for index, key_locations in enumerate(d2, 1):
+        locations = a.get_location_business_map(sorted(eval(key_locations)))
+        for key in locations:
+            pricing_events.append(PricingEvent("%s_%s_%s" % (a.name, index, key), a.get_header(),
+                                               locations[key], d2[key_locations], a.basedir))
+    return pricing_events
+
+
+def benchmark_location_groups(max_groups=5000):
+    """Time pricing event creation with str/eval and frozenset location group keys."""
+
+    for groups in (max_groups // 10, max_groups):
+        a = build_grouped_adjustment(groups)
+        for label, create_events in (("str/eval keys", legacy_pricing_events),
+                                     ("frozenset keys", Adjustment.get_pricing_events)):
+            start = time.time()
+            events = create_events(a)
+            print "%-15s %6d groups %7d events %8.2f s" % (label, groups, len(events), time.time() - start)
+
+
+def per_group_sorted_items(a):
+    """Previous grouping: items collected per location group in dict order and each group sorted separately."""
+
+    from operator import attrgetter
+    d = collections.defaultdict(set)
+    [d[item].add(location) for location, item in a.item_price.location_items()]
+    d2 = collections.defaultdict(list)
+    [d2[frozenset(v)].append(k) for k, v in d.items()]
+    for items in d2.values():
+        items.sort(key=attrgetter('item_style_code', 'item_color'))
+    return d2
+
+
+def globally_sorted_items(a):
+    """Current grouping: items sorted once and distributed to location groups in that order."""
+
+    item_locations = a.item_price.item_locations()
+    d2 = collections.defaultdict(list)
+    [d2[frozenset(v)].append(k) for k, v in item_locations]
+    return d2
+
+
+def benchmark_item_order(items=100000, groups=500):
+    """Time grouping and ordering the items of location groups with a sort per group and one global sort."""
+
+    a = build_grouped_adjustment(groups, items_per_group=items // groups, max_group_stores=5)
+    for label, group_items in (("sort per group", per_group_sorted_items), ("global sort", globally_sorted_items)):
+        elapsed = []
+        for repeat in xrange(3):
+            start = time.time()
+            d2 = group_items(a)
+            elapsed.append(time.time() - start)
+        print "%-15s %7d items %5d groups %7.3f s (best of 3)" % (label, len(a.item_price.items), len(d2),
+                                                                   min(elapsed))
+
+
+def replace_stores_with_set_loop(zone_sets, location_set):
+    """Original zone substitution: issubset check of every zone for every location group."""
+
+    rv = location_set
+    for zone, stores in zone_sets.items():
+        if stores.issubset(rv):
+            rv = (rv - stores) | frozenset([zone])
+    return rv
+
+
+def benchmark_zones(max_stores=5000, max_zones=500, groups=2000):
+    """Time zone substitution of location groups checking every zone and checking candidate zones only."""
+
+    for stores, zones in ((max_stores // 10, max_zones // 10), (max_stores, max_zones // 10), (max_stores, max_zones)):
+        rnd = random.Random(stores + zones)
+        store_ids = [str(10000 + i) for i in xrange(stores)]
+        zone_stores = collections.defaultdict(set)
+        for i, store in enumerate(store_ids):
+            zone_stores["Z%03d" % (i % zones)].add(store)
+        index = ZoneIndex(dict((zone, frozenset(s)) for zone, s in zone_stores.items()))
+
+        location_sets = []
+        for group in xrange(groups):  # some full zones and some single stores
+            locations = set(rnd.sample(store_ids, rnd.randint(1, 30)))
+            for zone in rnd.sample(index.zones.keys(), rnd.randint(0, 3)):
+                locations.update(index.zones[zone])
+            location_sets.append(frozenset(locations))
+
+        start = time.time()
+        expected = [replace_stores_with_set_loop(index.zones, locations) for locations in location_sets]
+        legacy = time.time() - start
+
+        start = time.time()
+        result = [index.replace_stores_with_zones(locations) for locations in location_sets]
+        candidates = time.time() - start
+
+        assert result == expected
+        print "%5d stores %4d zones %5d groups: all zones %7.3f s, candidate zones %7.3f s" % \
+              (stores, zones, groups, legacy, candidates)
+
+
+def legacy_export(event):
+    """Original writer: full row list and one writerow call per row."""
+
+    with open("%s.txt" % event.filename, 'wb') as f:
+        writer = csv.writer(f, dialect=csv.excel, delimiter="\t")
+        [writer.writerow(row) for row in event.get_export_rows()]
+
+
+def benchmark_export(groups=500, max_group_stores=60):
+    """Time writing the MMS files of an adjustment with the original and the buffered writer. Groups with
+    more than 25 stores are split into several files sharing the same item block."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        a = build_grouped_adjustment(groups, items_per_group=200, max_group_stores=max_group_stores)
+        a.basedir = workdir
+        events = a.get_pricing_events()
+        size = sum(len(format_rows(e.get_export_rows())) for e in events)
+
+        for label, export in (("writerow per row", legacy_export),
+                              ("buffered writerows", PricingEvent.export_tab_delimited)):
+            elapsed = None
+            for repeat in xrange(5):  # file system timings are noisy, use best run
+                events = a.get_pricing_events()  # new events without formatted item blocks
+                start = time.time()
+                [export(e) for e in events]
+                elapsed = min(elapsed, time.time() - start) if elapsed else time.time() - start
+            print "%-18s %5d files %8.1f MB %7.2f s %7.1f MB/s" % \
+                  (label, len(events), size / 1048576.0, elapsed, size / 1048576.0 / elapsed)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_publish_pool(files=24, item_rows=20000, workers=4):
+    """Time converting a burst of publish files one after another with one warm controller and with the
+    conversion pool."""
+
+    workdir = tempfile.mkdtemp()
+    try:
+        property_file = write_properties(workdir)
+        write_item_file(workdir, 50000)
+        shutil.copy(os.path.join('test', 'store_info.txt'), os.path.join(workdir, 'JDA_Store_benchmark.txt'))
+        output_dir = os.path.join(workdir, 'output')
+        os.mkdir(output_dir)
+        with open(property_file, 'a') as f:
+            f.write("output_dir = %s\n" % output_dir)
+        publish_file = write_publish_file(workdir, item_rows)
+        publish_files = []
+        for i in xrange(files):
+            publish_files.append(os.path.join(workdir, 'publish_%03d.txt' % i))
+            shutil.copy(publish_file, publish_files[-1])
+
+        c = ExportController(property_file)
+        start = time.time()
+        for name in publish_files:
+            c.reset()
+            c.process_file(name)
+        print "%-16s %3d files %8.2f s" % ("warm controller", files, time.time() - start)
+
+        pool = ConversionPool(property_file, os.path.join(workdir, 'publish_*.txt'),
+                              os.path.join(workdir, 'ledger.txt'), workers, settle_time=0)
+        start = time.time()
+        pool.discover()
+        pool.close()
+        print "%-16s %3d files %8.2f s (%d processes)" % ("conversion pool", files, time.time() - start, workers)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_header(calls=100000, groups=2000):
+    """Time header creation with and without the header/date caches, and get_pricing_events."""
+
+    a = build_grouped_adjustment(groups)
+
+    start = time.time()
+    for i in xrange(calls):
+        a.clear_headers()
+        a.schedule._formatted_dates.clear()
+        a.get_header()
+    print "%-24s %7d calls %8.3f s" % ("get_header, no caches", calls, time.time() - start)
+
+    start = time.time()
+    for i in xrange(calls):
+        a.get_header()
+    print "%-24s %7d calls %8.3f s" % ("get_header, cached", calls, time.time() - start)
+
+    elapsed = []
+    for repeat in xrange(3):
+        start = time.time()
+        events = a.get_pricing_events()
+        elapsed.append(time.time() - start)
+    print "%-24s %7d events %7.3f s (best of 3)" % ("get_pricing_events", len(events), min(elapsed))
+
+
+SCALES = [
+    {"styles": 200, "stores": 50, "zones": 5, "adjustments": 2, "styles_per_adjustment": 50,
+     "location_groups": 5, "max_group_stores": 10},
+    {"styles": 2000, "stores": 500, "zones": 50, "adjustments": 5, "styles_per_adjustment": 500,
+     "location_groups": 50, "max_group_stores": 30},
+    {"styles": 20000, "stores": 2000, "zones": 100, "adjustments": 10, "styles_per_adjustment": 2000,
+     "location_groups": 200, "max_group_stores": 60},
+    {"styles": 100000, "stores": 10000, "zones": 500, "adjustments": 20, "styles_per_adjustment": 5000,
+     "location_groups": 500, "max_group_stores": 100},  # about 5M item price rows
+]
+
+RESULTS_FILE = os.environ.get("BENCHMARK_RESULTS", "benchmark_results.jsonl")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_scaling(max_scale=1, seed=1):
+    """Convert generated data sets of SCALES 0..max_scale and print the stage timings of the run reports.
+    Results are appended as JSON lines to BENCHMARK_RESULTS (default benchmark_results.jsonl) for comparing
+    runs."""
+
+    for scale, knobs in enumerate(SCALES[:max_scale + 1]):
+        workdir = tempfile.mkdtemp()
+        try:
+            item_file, store_file, publish_file = generate(workdir, seed, **knobs)
+            output_dir = os.path.join(workdir, 'output')
+            os.mkdir(output_dir)
+            property_file = write_properties(workdir)
+            with open(property_file, 'a') as f:
+                f.write("output_dir = %s\nstreaming = true\nreport_file = %s\n" %
+                        (output_dir, os.path.join(workdir, 'report.json')))
+
+            c = ExportController(property_file)
+            start = time.time()
+            c.process_file(publish_file)
+            elapsed = time.time() - start
+            with open(c.report_file) as f:
+                report = json.load(f)
+        finally:
+            shutil.rmtree(workdir)
+
+        counters = report["counters"]
+        print "scale %d: %d item price rows, %d files, %.1f MB, %.2f s" % \
+              (scale, counters.get("records.I", 0), counters.get("events_written", 0),
+               counters.get("bytes_written", 0) / 1048576.0, elapsed)
+        for stage, timing in sorted(report["stages"].items(), key=lambda (stage, timing): -timing["seconds"]):
+            print "    %-22s %9.3f s %8d runs" % (stage, timing["seconds"], timing["count"])
+
+        with open(RESULTS_FILE, 'a') as f:
+            f.write(json.dumps({"benchmark": "scaling", "scale": scale, "seed": seed, "knobs": knobs,
+                                "commit": git_commit(), "python": platform.python_version(),
+                                "recorded": time.strftime("%Y-%m-%dT%H:%M:%S"), "seconds": round(elapsed, 3),
+                                "stages": report["stages"], "counters": counters}, sort_keys=True) + "\n")
+    print "Results appended to %s" % RESULTS_FILE
+
+
+BENCHMARKS = {
+    "dispatch": benchmark_dispatch,
+    "export": benchmark_export,
+    "header": benchmark_header,
+    "item_lookup": benchmark_item_lookup,
+    "item_order": benchmark_item_order,
+    "item_memory": benchmark_item_memory,
+    "location_check": benchmark_location_check,
+    "location_groups": benchmark_location_groups,
+    "parser": benchmark_parser,
+    "publish_pool": benchmark_publish_pool,
+    "scaling": benchmark_scaling,
+    "zones": benchmark_zones,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        raise SystemExit("Usage: %s <%s> [args]" % (sys.argv[0], "|".join(sorted(BENCHMARKS))))
+
+    BENCHMARKS[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
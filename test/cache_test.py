@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from app import cache
+from app.controller import ExportController
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.cache_dir, 'test.cache')
+        self.source_file = os.path.join(self.cache_dir, 'source.txt')
+        with open(self.source_file, 'w') as f:
+            f.write("a|b\n")
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build(self):
+        self.builds += 1
+        return {"a": {"b": "c"}}
+
+    def test_data_is_built_once(self):
+        self.assertEqual(cache.load(self.cache_file, self.source_file, self.build), {"a": {"b": "c"}})
+        self.assertEqual(cache.load(self.cache_file, self.source_file, self.build), {"a": {"b": "c"}})
+        self.assertEqual(self.builds, 1)
+
+    def test_changed_source_file_rebuilds_data(self):
+        cache.load(self.cache_file, self.source_file, self.build)
+
+        with open(self.source_file, 'a') as f:
+            f.write("c|d\n")
+        mtime = time.time() + 10
+        os.utime(self.source_file, (mtime, mtime))
+
+        cache.load(self.cache_file, self.source_file, self.build)
+        self.assertEqual(self.builds, 2)
+
+    def test_corrupted_cache_file_rebuilds_data(self):
+        with open(self.cache_file, 'wb') as f:
+            f.write("not marshal data")
+
+        self.assertEqual(cache.load(self.cache_file, self.source_file, self.build), {"a": {"b": "c"}})
+        self.assertEqual(self.builds, 1)
+
+    def test_replace_overwrites_existing_file(self):
+        temp_file = self.source_file + ".tmp"
+        with open(temp_file, 'w') as f:
+            f.write("e|f\n")
+
+        cache.replace(temp_file, self.source_file)
+        self.assertFalse(os.path.exists(temp_file))
+        with open(self.source_file) as f:
+            self.assertEqual(f.read(), "e|f\n")
+
+
+class TestItemInfoCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def create_controller(self, cache_dir):
+        c = ExportController()
+        c._item_info_file = os.path.join('test', 'item_info.txt')
+        c.cache_dir = cache_dir
+        return c
+
+    def test_cached_style_to_variant_map_equals_loaded_map(self):
+        loaded = self.create_controller(None)
+        self.create_controller(self.cache_dir).style_to_variant_map  # writes cache file
+        cached = self.create_controller(self.cache_dir)
+
+        self.assertEqual(cached.style_to_variant_map, loaded.style_to_variant_map)
+        self.assertEqual(cached.filter_counter, loaded.filter_counter)
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, 'style_to_variant.cache')))
+
+    def test_cached_map_returns_empty_colors_for_unknown_style(self):
+        self.create_controller(self.cache_dir).style_to_variant_map
+        c = self.create_controller(self.cache_dir)
+
+        self.assertEqual(c.get_color_codes_for_style("NO SUCH STYLE"), {})
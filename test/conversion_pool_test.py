@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.conversion_pool import ConversionPool
+from app.ledger import Ledger, file_key
+
+PUBLISH_FILE = """A|%s||Pool test %s||Promotion % Off
+S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1
+V|PriceCode|2|
+V|EventType|A|
+V|ReasonCode|A|
+V|Country|USA|
+V|DataType||
+V|BasedOn|2|
+V|OverrideAll||
+LB|5012|100|R
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD
+"""
+
+
+class TestLedger(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger_file = os.path.join(self.directory, 'ledger.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_keys_are_kept_between_instances(self):
+        Ledger(self.ledger_file).add("/in/publish_1.txt|10|1.5", "converted", 0.25)
+
+        ledger = Ledger(self.ledger_file)
+        self.assertTrue("/in/publish_1.txt|10|1.5" in ledger)
+        self.assertFalse("/in/publish_1.txt|11|2.5" in ledger)
+        self.assertEqual(1, len(ledger))
+
+    def test_failed_conversions_are_counted_but_not_converted(self):
+        Ledger(self.ledger_file).add("/in/publish_1.txt|10|1.5", "failed", 0.25)
+        Ledger(self.ledger_file).add("/in/publish_1.txt|10|1.5", "timeout", 3600)
+
+        ledger = Ledger(self.ledger_file)
+        self.assertFalse("/in/publish_1.txt|10|1.5" in ledger)
+        self.assertEqual(2, ledger.failures("/in/publish_1.txt|10|1.5"))
+        self.assertEqual(0, len(ledger))
+
+    def test_new_version_of_file_has_new_key(self):
+        publish_file = os.path.join(self.directory, 'publish_1.txt')
+        with open(publish_file, 'w') as f:
+            f.write("A|1\n")
+        key = file_key(publish_file)
+
+        with open(publish_file, 'a') as f:
+            f.write("A|2\n")
+        self.assertNotEqual(key, file_key(publish_file))
+
+
+class TestConversionPool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.directory, 'input')
+        self.output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+        shutil.copy(os.path.join('test', 'item_info.txt'), os.path.join(self.input_dir, 'JDA_Item_1.txt'))
+        shutil.copy(os.path.join('test', 'store_info.txt'), os.path.join(self.input_dir, 'JDA_Store_1.txt'))
+
+        self.property_file = os.path.join(self.directory, 'Guess.properties')
+        with open(self.property_file, 'w') as f:
+            f.write("[MMS]\ninput_dir = %s\noutput_dir = %s\nlog_level = WARNING\nlog_file = %s\nexport_workers = 4\n" %
+                    (self.input_dir, self.output_dir, os.path.join(self.directory, 'mms_conversion.log')))
+        self.ledger_file = os.path.join(self.directory, 'ledger.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_publish_file(self, number, content=None):
+        publish_file = os.path.join(self.input_dir, 'publish_%d.txt' % number)
+        with open(publish_file, 'w') as f:
+            f.write(content or PUBLISH_FILE.replace("%s", str(number)))
+        return publish_file
+
+    def create_pool(self, settle_time=0, timeout=3600):
+        return ConversionPool(self.property_file, os.path.join(self.input_dir, 'publish_*.txt'), self.ledger_file,
+                              workers=2, settle_time=settle_time, retries=1, timeout=timeout)
+
+    def test_every_publish_file_is_converted_once(self):
+        for number in range(4):
+            self.write_publish_file(number)
+
+        pool = self.create_pool()
+        self.assertIsNone(pool.discover())
+        pool.close()
+        self.assertEqual(0, pool.queue_depth)
+        self.assertEqual(4, len(os.listdir(self.output_dir)))
+
+        pool = self.create_pool()  # restarted poller
+        pool.discover()
+        self.assertEqual(0, pool.queue_depth)
+        pool.close()
+
+    def test_publish_file_being_written_is_not_queued(self):
+        self.write_publish_file(1)
+
+        pool = self.create_pool(settle_time=60)
+        settle_wait = pool.discover()
+        self.assertEqual(0, pool.queue_depth)
+        self.assertTrue(0 < settle_wait <= 60)
+        pool.close()
+
+    def test_failed_conversion_is_recorded(self):
+        self.write_publish_file(1, "X|invalid record type\n")
+
+        pool = self.create_pool()
+        pool.discover()
+        pool.close()
+
+        with open(self.ledger_file) as f:
+            self.assertTrue(f.read().rstrip().split("|")[-2] == "failed")
+        self.assertEqual([], os.listdir(self.output_dir))
+
+    def test_failed_conversion_is_retried(self):
+        publish_file = self.write_publish_file(1)
+        os.rename(os.path.join(self.input_dir, 'JDA_Item_1.txt'), os.path.join(self.directory, 'JDA_Item_1.txt'))
+
+        pool = self.create_pool()
+        pool.discover()  # item information file has not been uploaded yet
+        pool.close()
+        self.assertEqual(1, pool.ledger.failures(file_key(publish_file)))
+
+        os.rename(os.path.join(self.directory, 'JDA_Item_1.txt'), os.path.join(self.input_dir, 'JDA_Item_1.txt'))
+        pool.discover()
+        pool.close()
+        self.assertTrue(file_key(publish_file) in pool.ledger)
+        self.assertTrue(os.listdir(self.output_dir))
+
+    def test_failed_conversion_is_retried_at_most_retries_times(self):
+        self.write_publish_file(1, "X|invalid record type\n")
+
+        pool = self.create_pool()
+        for attempt in range(4):
+            pool.discover()
+            pool.close()
+
+        with open(self.ledger_file) as f:
+            self.assertEqual(2, len(f.readlines()))
+
+    def test_conversion_not_finished_in_timeout_is_failed(self):
+        publish_file = self.write_publish_file(1)
+
+        pool = self.create_pool(timeout=0)
+        pool.discover()
+        pool.close()
+
+        self.assertEqual(0, pool.queue_depth)
+        self.assertEqual(1, pool.ledger.failures(file_key(publish_file)))
+
+    def test_files_of_same_adjustment_are_converted_in_order(self):
+        older = self.write_publish_file(1, PUBLISH_FILE.replace("%s", "1"))
+        newer = self.write_publish_file(2, PUBLISH_FILE.replace("%s", "1").replace("123.456", "99.99"))
+        other = self.write_publish_file(3)
+        for mtime, publish_file in ((1000, older), (2000, newer), (3000, other)):
+            os.utime(publish_file, (mtime, mtime))
+
+        pool = self.create_pool()
+        pool.discover()
+        self.assertFalse(newer in pool._queued)  # waits for the older file
+        pool.close()
+        pool.discover()
+        pool.close()
+
+        with open(self.ledger_file) as f:
+            converted = [line.split("|")[0] for line in f]
+        self.assertTrue(converted.index(os.path.abspath(older)) < converted.index(os.path.abspath(newer)))
+        self.assertEqual(3, len(converted))
+        [output] = [name for name in os.listdir(self.output_dir) if name.startswith("Pool test 1")]
+        with open(os.path.join(self.output_dir, output)) as f:
+            self.assertTrue("99.99" in f.read())
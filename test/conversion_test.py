@@ -3,7 +3,9 @@ from unittest import TestCase
 
 from app.adjustment import Adjustment, AdjustmentDescription, UserHierarchyNode, CustomerHierarchyNode, \
     LocationHierarchyNode, ProductHierarchyNode, AdjustmentParameters, LocationBusiness, ItemPrice, AdjustmentSchedule
+from app.adjustment import format_rows
 from app.controller import ExportController
+from app.parser import CsvParser
 
 
 class TestExportController(TestCase):
@@ -62,6 +64,28 @@ I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|RED|11066279|1200|USD""
         self.assertEqual(h_vals[10], "06/30/2016")  # EndDate USA format
         self.assertEqual(h_vals[11], "")  # % Off, never used
 
+    def test_header_is_rebuilt_when_parameters_change(self):
+        a = self.c.current_adjustment
+        self.assertIs(a.get_header(), a.get_header())
+
+        self.c.process_line("V|PriceCode|3|")
+        self.assertEqual(a.get_header()[1][2], "3")
+
+        self.c.process_line("S|2016-07-01|2016-07-31|||1|1|1|1|1|1|1")
+        self.assertEqual(a.get_header()[1][9], "07/01/2016")
+        self.assertEqual(a.get_header_block(), format_rows(a.get_header()))
+
+    def test_header_is_rebuilt_when_parameters_are_changed_directly(self):
+        a = self.c.current_adjustment
+        a.get_header_block()
+
+        a.parameters["ReasonCode"] = AdjustmentParameters("ReasonCode", "B", "")
+        self.assertEqual(a.get_header()[1][4], "B")
+
+        a.parameters["EventType"].value = "X"
+        self.assertEqual(a.get_header()[1][3], "X")
+        self.assertEqual(a.get_header_block(), format_rows(a.get_header()))
+
     def test_location_business_row(self):
         a = self.c.current_adjustment
         l = a.get_location_business_map(a.location_business.keys())
@@ -93,6 +117,32 @@ I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|RED|11066279|1200|USD""
         rows = e2.get_export_rows()
         self.assertEqual(len(rows), 2 + 1 + 1 + 1)  # headers(2), location row, item header, 1 item (1 filtered)
 
+    def test_exported_file_contains_export_rows(self):
+        import shutil, tempfile
+
+        a = self.c.current_adjustment
+        a.basedir = tempfile.mkdtemp()
+        try:
+            for e in a.get_pricing_events():
+                e.export_tab_delimited()
+                with open("%s.txt" % e.filename, 'rb') as f:
+                    self.assertEqual(f.read(), format_rows(e.get_export_rows()))
+        finally:
+            shutil.rmtree(a.basedir)
+
+    def test_failed_export_removes_temporary_file(self):
+        import shutil, tempfile
+
+        a = self.c.current_adjustment
+        a.basedir = tempfile.mkdtemp()
+        try:
+            e = a.get_pricing_events()[0]
+            e.item_block = None  # writing items fails
+            self.assertRaises(AttributeError, e.export_tab_delimited)
+            self.assertEqual([], os.listdir(a.basedir))
+        finally:
+            shutil.rmtree(a.basedir)
+
     def test_process_file(self):
         import os
         test_file = os.path.join('test', 'adjustment_mega_test.txt')
@@ -153,6 +203,37 @@ I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|RED|11066279|1200|USD""
 
         self.assertListEqual(e.locations, ["100", "6588"])
 
+    def test_zone_price_and_full_zone_store_prices_share_event(self):
+
+        '''Stores replaced with a zone end up in the same event as prices given for the zone itself'''
+
+        self.c = ExportController()
+        self.c._item_info_file = os.path.join('test', 'item_info.txt')
+        self.c._store_info_file = os.path.join('test', 'store_info.txt')
+
+        lines = """A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off
+S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1
+V|PriceCode|2|
+V|EventType|A|
+V|ReasonCode|A|
+V|Country|USA|
+V|DataType||
+V|BasedOn|2|
+V|OverrideAll||
+LB|5012|100|R
+LB|5501|100|R
+I||||||LUSA-100|100||2016-06-01|2016-06-30|1|RAISE|||10.00|USD
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|23002G3|||1234.567|USD
+I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|||1234.567|USD""".split("\n")
+
+        for line in lines:
+            self.c.process_line(line)
+
+        events = self.c.current_adjustment.get_pricing_events()
+        self.assertEqual(1, len(events))
+        self.assertListEqual(events[0].locations, ["100"])
+        self.assertListEqual([item.item_style_code for item in events[0].items], ["23002G3", "RAISE", "RAISE"])
+
     def test_location_with_zone_only(self):
 
         '''If event contains all stores from a zone -> replace store list with zone'''
@@ -243,3 +324,264 @@ I||||||LUSA-100|100||2016-08-10|2016-08-15|1|GWKIRBY||11507745|1727.62|USD""".sp
         #location_row = e.get_export_rows()[2]
         #location = location_row[1]
         #self.assertEqual(location, "100")
+
+
+TWO_ADJUSTMENTS = """A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off
+S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1
+V|PriceCode|2|
+V|EventType|A|
+V|ReasonCode|A|
+V|Country|USA|
+V|DataType||
+V|BasedOn|2|
+V|OverrideAll||
+LB|5012|100|R
+LB|5501|100|R
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|23002G3|||1234.567|USD
+I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|||1234.567|USD
+I||||||LUSA-100|100|5501|2016-06-01|2016-06-30|1|23002G3|RED|11066279|1200|USD
+A|5D3DA9128AE34D4BA9250D31D07499F7|5D3DA9128AE34D4BA9250D31D07499F7|BM RC 60% 5013+|BM RC 60% 5013+|Promotion %
+S|2016-08-10|2016-08-15|||1|1|1|1|1|1|1
+V|PriceCode|Store|
+V|EventType|A|
+V|ReasonCode|B|
+V|Country|USA|
+V|DataType|I|
+V|BasedOn||
+V|OverrideAll|No|
+I||||||LUSA-100|100||2016-08-10|2016-08-15|1|PRETZEL|||63.98|USD
+I||||||LUSA-100|100||2016-08-10|2016-08-15|1|GWKIRBY|||143.90|USD
+I||||||LUSA-100|100||2016-08-10|2016-08-15|1|GWKIRBY||11507739|2591.42|USD"""
+
+
+class TestStreamingConversion(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.output_dir = tempfile.mkdtemp()
+
+        self.c = ExportController()
+        self.c._item_info_file = os.path.join('test', 'item_info.txt')
+        self.c._store_info_file = os.path.join('test', 'store_info.txt')
+        self.c.output_dir = self.output_dir
+
+        self.publish_file = os.path.join(self.output_dir, 'publish.txt')
+        with open(self.publish_file, 'w') as f:
+            f.write(TWO_ADJUSTMENTS + "\n")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.output_dir)
+
+    def exported_files(self):
+        return sorted(name for name in os.listdir(self.output_dir) if name != 'publish.txt')
+
+    def test_streaming_exports_every_adjustment_block(self):
+        self.c.streaming = True
+        self.c.process_file(self.publish_file)
+
+        files = self.exported_files()
+        self.assertTrue([name for name in files if name.startswith("Back to school 10% off_")])
+        self.assertTrue([name for name in files if name.startswith("BM RC 60% 5013+_")])
+
+    def test_streaming_releases_exported_adjustments(self):
+        self.c.streaming = True
+        self.c.process_file(self.publish_file)
+
+        self.assertEqual({}, self.c.adjustments)
+        self.assertEqual({}, self.c.item_price_map)
+
+    def read_and_remove_exported_files(self):
+        rv = {}
+        for name in self.exported_files():
+            with open(os.path.join(self.output_dir, name)) as f:
+                rv[name] = f.read()
+            os.remove(os.path.join(self.output_dir, name))
+        return rv
+
+    def test_streaming_output_matches_batch_output(self):
+        self.c.streaming = True
+        self.c.process_file(self.publish_file)
+        streamed = self.read_and_remove_exported_files()
+
+        self.c.streaming = False
+        self.c.process_file(self.publish_file)
+        batch = self.read_and_remove_exported_files()
+
+        self.assertEqual(streamed, batch)
+
+    def test_batch_exports_every_adjustment(self):
+        self.c.process_file(self.publish_file)
+
+        self.assertEqual(2, len(self.c.adjustments))
+        files = self.exported_files()
+        self.assertTrue([name for name in files if name.startswith("Back to school 10% off_")])
+        self.assertTrue([name for name in files if name.startswith("BM RC 60% 5013+_")])
+
+    def test_export_pool_output_matches_single_process_output(self):
+        self.c.process_file(self.publish_file)
+        single = self.read_and_remove_exported_files()
+
+        self.c.export_workers = 2
+        self.c.process_file(self.publish_file)
+        pooled = self.read_and_remove_exported_files()
+
+        self.assertTrue(single)
+        self.assertEqual(single, pooled)
+        self.assertIsNone(self.c._export_pool)
+
+    def test_writer_threads_output_matches_sequential_output(self):
+        self.c.process_file(self.publish_file)
+        sequential = self.read_and_remove_exported_files()
+
+        self.c.writer_threads = 3
+        self.c.process_file(self.publish_file)
+        threaded = self.read_and_remove_exported_files()
+
+        self.assertTrue(sequential)
+        self.assertEqual(sequential, threaded)
+
+    def test_csv_parser_output_matches_split_parser_output(self):
+        self.c.process_file(self.publish_file)
+        split = self.read_and_remove_exported_files()
+
+        self.c.parser = CsvParser()
+        self.c.process_file(self.publish_file)
+        parsed = self.read_and_remove_exported_files()
+
+        self.assertTrue(split)
+        self.assertEqual(split, parsed)
+
+    def test_reset_keeps_item_information_of_unchanged_file(self):
+        self.c.process_file(self.publish_file)
+        variants = self.c.style_to_variant_map
+
+        self.c.reset()
+        self.assertEqual({}, self.c.adjustments)
+        self.assertIs(variants, self.c.style_to_variant_map)
+
+    def test_reset_reloads_changed_item_information_file(self):
+        import shutil, time
+        item_file = os.path.join(self.output_dir, 'item_info.txt')
+        shutil.copy(os.path.join('test', 'item_info.txt'), item_file)
+        self.c._item_info_file = item_file
+        self.c.process_file(self.publish_file)
+        variants = self.c.style_to_variant_map
+
+        with open(item_file, 'a') as f:
+            f.write("99999999|NEW ITEM|A|NEWSTYLE|3|10|115|115|NEW|30||0|\n")
+        mtime = time.time() + 10
+        os.utime(item_file, (mtime, mtime))
+
+        self.c.reset()
+        self.assertIsNot(variants, self.c.style_to_variant_map)
+        self.assertEqual({"99999999": "NEW"}, self.c.get_color_codes_for_style("NEWSTYLE"))
+
+    def read_report(self):
+        import json
+        with open(self.c.report_file) as f:
+            return json.load(f)
+
+    def test_run_report(self):
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        report = self.read_report()
+        os.remove(self.c.report_file)
+
+        files = self.exported_files()
+        counters = report["counters"]
+        self.assertEqual(os.path.abspath(self.publish_file), report["publish_file"])
+        self.assertEqual(2, counters["records.A"])
+        self.assertEqual(len(files), counters["events_written"])
+        self.assertEqual(sum(os.path.getsize(os.path.join(self.output_dir, name)) for name in files),
+                         counters["bytes_written"])
+        for stage in ("parse.I", "load_item_info", "load_store_info", "group_locations", "replace_zones",
+                      "create_events", "write_files"):
+            self.assertTrue(stage in report["stages"], stage)
+        self.assertEqual(len([line for line in TWO_ADJUSTMENTS.split("\n") if line.startswith("I|")]),
+                         counters["records.I"])
+
+    def test_run_report_counts_filtered_items_with_item_index(self):
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        filtered = self.read_report()["counters"]["filtered_items"]
+
+        self.c.reset()
+        self.c.item_lookup = "index"
+        self.c._style_to_variant_map = None
+        self.c.process_file(self.publish_file)
+        self.assertEqual(filtered, self.read_report()["counters"]["filtered_items"])
+        os.remove(self.c.report_file)
+
+    def test_streaming_export_is_not_timed_as_record_parsing(self):
+        import time
+        export_adjustment = self.c.export_adjustment
+
+        def slow_export(adjustment):
+            time.sleep(0.2)
+            export_adjustment(adjustment)
+
+        self.c.export_adjustment = slow_export
+        self.c.streaming = True
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        stages = self.read_report()["stages"]
+        os.remove(self.c.report_file)
+
+        self.assertTrue(stages["parse.I"]["seconds"] < 0.1)
+        self.assertEqual(2, stages["export"]["count"])
+
+    def test_run_report_includes_memory_profile(self):
+        from app.memory import MemoryProfiler
+        self.c.memory_profiler = MemoryProfiler(use_tracemalloc=False)
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        memory = self.read_report()["memory"]
+        os.remove(self.c.report_file)
+
+        for stage in ("parse.I", "load_item_info", "group_locations", "write_files"):
+            self.assertTrue(stage in memory["stages"], stage)
+        self.assertTrue(memory["stages"]["load_item_info"]["top_sites"])
+
+    def test_failed_file_exports_are_not_collected_for_next_file(self):
+        self.c.streaming = True
+        self.c.export_workers = 2
+        with open(self.publish_file, 'w') as f:
+            f.write(TWO_ADJUSTMENTS + "\nX|invalid record\n")
+        self.assertRaises(Exception, self.c.process_file, self.publish_file)
+        self.assertIsNone(self.c._export_pool)
+        self.assertEqual([], self.c._pending_exports)
+
+        with open(self.publish_file, 'w') as f:
+            f.write(TWO_ADJUSTMENTS.split("\nA|")[0] + "\n")
+        self.c.reset()
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        counters = self.read_report()["counters"]
+        os.remove(self.c.report_file)
+        self.assertEqual(1, counters["records.A"])
+        self.assertEqual(counters["events_written"], counters["events"])
+        self.assertEqual(len([name for name in self.exported_files() if name.startswith("Back to school")]),
+                         counters["events"])
+
+    def test_reset_stops_export_pool(self):
+        self.c.export_workers = 2
+        for line in TWO_ADJUSTMENTS.split("\nA|")[0].split("\n"):
+            self.c.process_line(line)
+        self.c.export_adjustment(self.c.current_adjustment)
+        self.assertEqual(1, len(self.c._pending_exports))
+
+        self.c.reset()
+        self.assertIsNone(self.c._export_pool)
+        self.assertEqual([], self.c._pending_exports)
+
+    def test_run_report_includes_export_pool_reports(self):
+        self.c.report_file = os.path.join(self.output_dir, 'report.json')
+        self.c.process_file(self.publish_file)
+        single = self.read_report()["counters"]
+
+        self.c.export_workers = 2
+        self.c.writer_threads = 2
+        self.c.process_file(self.publish_file)
+        self.assertEqual(single, self.read_report()["counters"])
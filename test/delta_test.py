@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.adjustment import PricingEvent, ItemKey
+from app.controller import ExportController
+from app.delta import FingerprintStore
+
+PUBLISH_FILE = """A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off
+S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1
+V|PriceCode|2|
+V|EventType|A|
+V|ReasonCode|A|
+V|Country|USA|
+V|DataType||
+V|BasedOn|2|
+V|OverrideAll||
+LB|5012|100|R
+LB|6588|300|R
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD
+I||||||LUSA-300|300|6588|2016-06-01|2016-06-30|1|23002G3|||PRICE|USD
+"""
+
+HEADERS = [["H", "Description"], ["H", "Delta test"]]
+
+
+class TestFingerprintStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FingerprintStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def event(self, name, location, price):
+        return PricingEvent(name, HEADERS, [location], [ItemKey("", "", "1", "RAISE", "MDGRN", "", price, "USD")],
+                            self.directory)
+
+    def test_first_export_writes_all_events(self):
+        events = [self.event("e_1_1", "5012", "10.00"), self.event("e_2_1", "5501", "10.00")]
+        self.assertEqual(self.store.select("OID", events).written, events)
+
+    def test_changed_new_and_removed_events(self):
+        self.store.update("OID", [self.event("e_1_1", "5012", "10.00"), self.event("e_2_1", "5501", "10.00")])
+
+        unchanged = self.event("e_1_1", "5012", "10.00")
+        changed = self.event("e_2_1", "5501", "12.00")
+        new = self.event("e_3_1", "6588", "10.00")
+        delta = self.store.select("OID", [unchanged, changed, new])
+
+        self.assertEqual(delta.written, [changed, new])
+        self.assertEqual(delta.unchanged, [unchanged])
+        self.assertEqual(delta.removed, ["e_2_1"])
+
+    def test_renamed_event_with_same_content_is_unchanged(self):
+        self.store.update("OID", [self.event("e_1_1", "5012", "10.00")])
+        delta = self.store.select("OID", [self.event("e_2_1", "5012", "10.00")])
+
+        self.assertEqual(delta.written, [])
+        self.assertEqual(delta.removed, [])
+
+
+class TestDeltaConversion(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(self.output_dir)
+
+        self.c = ExportController()
+        self.c._item_info_file = os.path.join('test', 'item_info.txt')
+        self.c._store_info_file = os.path.join('test', 'store_info.txt')
+        self.c.output_dir = self.output_dir
+        self.c.cache_dir = os.path.join(self.directory, 'cache')
+        self.c.delta = True
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, price):
+        publish_file = os.path.join(self.directory, 'publish.txt')
+        with open(publish_file, 'w') as f:
+            f.write(PUBLISH_FILE.replace("PRICE", price))
+
+        [os.remove(os.path.join(self.output_dir, name)) for name in os.listdir(self.output_dir)]
+        self.c.process_file(publish_file)
+        return sorted(os.listdir(self.output_dir))
+
+    def test_only_changed_events_are_written(self):
+        self.assertEqual(len(self.convert("1234.567")), 2)
+        self.assertEqual(self.convert("1234.567"), [])
+
+        changed = self.convert("999.00")
+        self.assertEqual(len(changed), 1)
+        with open(os.path.join(self.output_dir, changed[0])) as f:
+            self.assertTrue("999.00" in f.read())
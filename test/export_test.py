@@ -4,8 +4,10 @@ from unittest import TestCase
 import datetime
 
 from app.adjustment import Adjustment, AdjustmentDescription, UserHierarchyNode, CustomerHierarchyNode, \
-    LocationHierarchyNode, ProductHierarchyNode, AdjustmentParameters, LocationBusiness, ItemPrice, AdjustmentSchedule
+    LocationHierarchyNode, ProductHierarchyNode, AdjustmentParameters, LocationBusiness, ItemPrice, AdjustmentSchedule, \
+    ItemPriceTable, ItemKey, format_rows, format_item_rows
 from app.controller import ExportController
+from app.index import ZoneIndex
 
 
 class TestExportController(TestCase):
@@ -144,6 +146,22 @@ class TestExportController(TestCase):
         fields = "I||||||LUSA-100|100|1234|2016-06-01|2016-06-30|1|76074 32|||123.456|USD".split("|")[1:]
         self.assertRaises(Exception, self.c.add_item_price, fields)
 
+    def test_add_item_price_with_zone_as_location(self):
+        fields = "LB|5012|100|R".split("|")[1:]
+        self.c.add_location_business(fields)
+
+        fields = "I||||||LUSA-300|300|300|2016-06-01|2016-06-30|1|76074 32|||123.456|USD".split("|")[1:]
+        self.c.add_item_price(fields)
+        self.assertTrue(self.c.current_adjustment.item_price)
+
+    def test_valid_locations_are_reset_for_next_adjustment(self):
+        fields = "LB|5012|100|R".split("|")[1:]
+        self.c.add_location_business(fields)
+        self.c.add_adjustment("A|B25E3EE9AFA248A79DF07D2565410784||Next||Promotion % Off".split("|")[1:])
+
+        fields = "I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD".split("|")[1:]
+        self.assertRaises(Exception, self.c.add_item_price, fields)
+
     def test_line_processing(self):
 
         lines = """A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off
@@ -238,6 +256,37 @@ class TestAdjustment(TestCase):
         self.assertEqual(self.a.rule_name, "Promotion % Off")
 
 
+    def test_chunked_events_share_item_block(self):
+        self.a.schedule = AdjustmentSchedule(*"S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1".split("|")[1:])
+        for name, value in (("PriceCode", "2"), ("EventType", "A"), ("ReasonCode", "A"), ("Country", "USA"),
+                            ("DataType", ""), ("BasedOn", "2"), ("OverrideAll", "")):
+            self.a.parameters[name] = AdjustmentParameters(name, value, "")
+        for location in ("5012", "5501", "6588"):
+            self.a.item_price.append(("", "", "", "", "", "LUSA", "USA", location, "2016-06-01", "2016-06-30", "1",
+                                      "23002G3", "NC", "676099", "1200", "USD"))
+        self.a._MAX_EVENT_LOCATIONS = 2
+
+        e1, e2 = self.a.get_pricing_events()
+        self.assertIs(e1.item_block, e2.item_block)
+        self.assertEqual(e1.locations, ["5012", "5501"])
+        self.assertEqual(e2.locations, ["6588"])
+        self.assertEqual(e1.item_block.data, format_rows(e1.get_export_rows()[3:]))
+
+    def test_groups_merged_by_zone_keep_item_order(self):
+        self.a.schedule = AdjustmentSchedule(*"S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1".split("|")[1:])
+        for name, value in (("PriceCode", "2"), ("EventType", "A"), ("ReasonCode", "A"), ("Country", "USA"),
+                            ("DataType", ""), ("BasedOn", "2"), ("OverrideAll", "")):
+            self.a.parameters[name] = AdjustmentParameters(name, value, "")
+        self.a.zone_index = ZoneIndex({"100": frozenset(["5012", "5501"])})
+        for locations, style in ((("100",), "B"), (("5012", "5501"), "A"), (("100",), "D"), (("5012", "5501"), "C")):
+            for location in locations:
+                self.a.item_price.append(("", "", "", "", "", "LUSA", "USA", location, "2016-06-01", "2016-06-30",
+                                          "1", style, "NC", "", "1200", "USD"))
+
+        [e] = self.a.get_pricing_events()
+        self.assertEqual([i.item_style_code for i in e.items], ["A", "B", "C", "D"])
+
+
 class TestAdjustmentDescription(TestCase):
 
     def setUp(self):
@@ -280,6 +329,14 @@ class TestAdjustmentSchedule(TestCase):
         self.assertEqual(a.sat, "1")
         self.assertEqual(a.sun, "1")
 
+    def test_formatted_dates_are_cached(self):
+        fields = "S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1".split("|")[1:]
+        a = AdjustmentSchedule(*fields)
+        self.assertIs(a.start_date("USA"), a.start_date("USA"))
+
+        a._start_date = datetime.datetime(2016, 7, 1)
+        self.assertEqual(a.start_date("USA"), "07/01/2016")
+
     def test_schedule_date_with_unsupported_country(self):
         fields = "S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1".split("|")[1:]
         a = AdjustmentSchedule(*fields)
@@ -370,3 +427,125 @@ class TestItemPrice(TestCase):
         self.assertEqual(p.variant_item_name, "")
         self.assertEqual(p.item_price, "123.456")
         self.assertEqual(p.currency, "USD")
+
+
+class TestItemPriceTable(TestCase):
+
+    def setUp(self):
+        self.t = ItemPriceTable()
+        self.fields = "I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD".split("|")[1:]
+
+    def test_row_is_returned_as_item_price(self):
+        index = self.t.append(self.fields)
+
+        p = self.t[index]
+        self.assertIsInstance(p, ItemPrice)
+        self.assertEqual(p, ItemPrice(*self.fields))
+        self.assertEqual(p.location_external_id, "5012")
+        self.assertEqual(p.location_hierarchy_oid, "LUSA-100")
+        self.assertEqual(len(self.t), 1)
+
+    def test_row_can_be_replaced(self):
+        index = self.t.append(self.fields)
+        self.t.append(self.fields)
+
+        fields = list(self.fields)
+        fields[14] = "99.00"
+        self.t[index] = fields
+        self.assertEqual(self.t[index].item_price, "99.00")
+        self.assertEqual(self.t[1].item_price, "123.456")
+
+    def test_equal_values_are_stored_once(self):
+        self.t.append(self.fields)
+        fields = list(self.fields)
+        fields[7] = "5501"
+        self.t.append(fields)
+
+        self.assertEqual(len(self.t.items), 1)
+        self.assertEqual(len(self.t.contexts), 1)
+        self.assertEqual(len(self.t.locations), 2)
+
+        (l1, i1), (l2, i2) = self.t.location_items()
+        self.assertEqual((l1, l2), ("5012", "5501"))
+        self.assertIs(i1, i2)
+
+    def test_invalid_field_count(self):
+        self.assertRaises(TypeError, self.t.append, self.fields[1:])
+
+    def item_fields(self, location, style, color, price):
+        fields = list(self.fields)
+        fields[7], fields[11], fields[12], fields[14] = location, style, color, price
+        return fields
+
+    def test_item_locations_are_in_export_order(self):
+        self.t.append(self.item_fields("5012", "B", "RED", "2.00"))
+        self.t.append(self.item_fields("5012", "A", "RED", "2.00"))
+        self.t.append(self.item_fields("5501", "B", "RED", "1.00"))
+        self.t.append(self.item_fields("5501", "A", "RED", "2.00"))
+        self.t.append(self.item_fields("5012", "A", "BLUE", "2.00"))
+
+        self.assertEqual([(i.item_style_code, i.item_color, i.item_price, l) for i, l in self.t.item_locations()],
+                         [("A", "BLUE", "2.00", set(["5012"])),
+                          ("A", "RED", "2.00", set(["5012", "5501"])),
+                          ("B", "RED", "1.00", set(["5501"])),
+                          ("B", "RED", "2.00", set(["5012"]))])
+
+    def test_item_locations_skip_replaced_items(self):
+        index = self.t.append(self.item_fields("5012", "A", "RED", "2.00"))
+        self.t[index] = self.item_fields("5012", "A", "RED", "3.00")
+
+        self.assertEqual([i.item_price for i, l in self.t.item_locations()], ["3.00"])
+
+    def test_style_price_is_expanded_to_variants(self):
+        row = self.t.append_style(self.item_fields("5012", "A", "", "2.00"), {"1001": "RED", "1002": "BLUE"})
+        fields = self.item_fields("5012", "A", "BLUE", "1.00")
+        fields[13] = "1002"
+        self.t.override(row, fields)
+
+        self.assertEqual(2, len(self.t))
+        self.assertEqual(set([("RED", "1001", "2.00"), ("BLUE", "1002", "1.00")]),
+                         set((p.item_color, p.variant_item_name, p.item_price) for p in self.t))
+        self.assertEqual([(i.item_color, i.variant_item_name, i.item_price, l) for i, l in self.t.item_locations()],
+                         [("BLUE", "1002", "1.00", set(["5012"])), ("RED", "1001", "2.00", set(["5012"]))])
+
+    def test_style_prices_with_equal_price_share_variant_items(self):
+        variants = {"1001": "RED"}
+        self.t.append_style(self.item_fields("5012", "A", "", "2.00"), variants)
+        row = self.t.append_style(self.item_fields("5501", "A", "", "2.00"), variants)
+        fields = self.item_fields("5501", "A", "RED", "2.00")
+        fields[13] = "1001"
+        self.t.override(row, fields)
+
+        self.assertEqual([(i.variant_item_name, l) for i, l in self.t.item_locations()],
+                         [("1001", set(["5012", "5501"]))])
+
+    def test_override_replaces_only_latest_style_price_of_location(self):
+        variants = {"1001": "RED"}
+        self.t.append_style(self.item_fields("5012", "A", "", "2.00"), variants)
+        self.t.append_style(self.item_fields("5012", "A", "", "2.00"), variants)
+        fields = self.item_fields("5012", "A", "RED", "1.00")
+        fields[13] = "1001"
+        self.t[len(self.t) - 1] = fields
+
+        self.assertEqual(self.t[len(self.t) - 1].item_price, "1.00")
+        self.assertEqual([(i.item_price, l) for i, l in self.t.item_locations()],
+                         [("1.00", set(["5012"])), ("2.00", set(["5012"]))])
+
+
+class TestExportFormatting(TestCase):
+
+    def item_rows(self, items):
+        return [["", "", item.item_style_code, item.item_color, item.item_price] for item in items]
+
+    def test_item_rows_match_csv_output(self):
+        items = [ItemKey("", "", "1", "76074 32", "HMS", "673394", "123.456", "USD"),
+                 ItemKey("", "", "1", "23002G3", "NC", "676099", "1200", "USD")]
+        self.assertEqual(format_item_rows(items), format_rows(self.item_rows(items)))
+
+    def test_item_rows_needing_quotes_match_csv_output(self):
+        items = [ItemKey("", "", "1", 'LM 5 PKT 32"', "HMS", "673394", "123.456", "USD"),
+                 ItemKey("", "", "1", "TAB\tSTYLE", "NC", "676099", "1200", "USD")]
+        self.assertEqual(format_item_rows(items), format_rows(self.item_rows(items)))
+
+    def test_no_items(self):
+        self.assertEqual(format_item_rows([]), "")
@@ -0,0 +1,129 @@
+"""Seedable generator of item information, store information and Pricer publish files.
+
+Run from the project root, e.g.:
+
+    python test/generator.py /tmp/mms_data 42
+"""
+import os
+import random
+import sys
+
+DEFAULTS = {
+    "styles": 1000,  # styles in item information file
+    "colors_per_style": 5,  # variants (colors) of each style
+    "filtered_ratio": 0.02,  # share of item information rows with a filter code, skipped by conversion
+    "stores": 200,
+    "zones": 20,  # stores are spread evenly over zones
+    "adjustments": 5,
+    "styles_per_adjustment": 200,
+    "location_groups": 20,  # distinct location sets per adjustment, each priced style uses one of them
+    "max_group_stores": 30,
+    "zone_group_ratio": 0.2,  # share of location groups priced by zone instead of store list
+    "variant_override_ratio": 0.1,  # share of variants of a priced style that get their own price
+}
+
+PARAMETERS = ["V|PriceCode|2|", "V|EventType|A|", "V|ReasonCode|A|", "V|Country|USA|", "V|DataType||",
+              "V|BasedOn|2|", "V|OverrideAll||"]
+
+
+def style_code(style):
+    return "S%07d" % style
+
+
+def variant_code(style, color):
+    return str(10000000 + style * 100 + color)
+
+
+def store_code(store):
+    return str(1000 + store)
+
+
+def zone_code(zone):
+    return str(100 + zone)
+
+
+def write_item_file(file_name, rnd, styles, colors_per_style, filtered_ratio, **knobs):
+    with open(file_name, 'w') as f:
+        for style in xrange(styles):
+            f.writelines("%s|GENERATED ITEM %d|A|%s|3|10|115|115|C%02d|30||%d|\n" %
+                         (variant_code(style, color), style, style_code(style), color,
+                          rnd.random() < filtered_ratio) for color in xrange(colors_per_style))
+
+
+def write_store_file(file_name, rnd, stores, zones, **knobs):
+    with open(file_name, 'w') as f:
+        for store in xrange(stores):
+            region = rnd.randint(200, 209)
+            f.write("%s|GENERATED STORE %d|USA|%d|Region %d|%d|District %d|%s|F||\n" %
+                    (store_code(store), store, region, region, region + 20, region + 20, zone_code(store % zones)))
+
+
+def adjustment_lines(rnd, number, styles, colors_per_style, stores, zones, styles_per_adjustment, location_groups,
+                     max_group_stores, zone_group_ratio, variant_override_ratio, **knobs):
+    """Return publish file lines of one adjustment."""
+
+    zone_stores = [range(zone, stores, zones) for zone in xrange(zones)]
+    groups = []  # (zone or None, store numbers)
+    for i in xrange(location_groups):
+        if rnd.random() < zone_group_ratio:
+            zone = rnd.randrange(zones)
+            groups.append((zone, zone_stores[zone]))
+        else:
+            groups.append((None, rnd.sample(xrange(stores), rnd.randint(1, min(max_group_stores, stores)))))
+
+    lines = ["A|%032X||Generated adjustment %d||Promotion %% Off" % (rnd.getrandbits(128), number),
+             "D|Pen|Generated adjustment %d|" % number,
+             "S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1",
+             "U|H|I||All",
+             "C|H|I||All|",
+             "L|H|I|LUSA-200|200|"]
+    lines.extend(PARAMETERS)
+    lines.extend("LB|%s|%s|R" % (store_code(store), zone_code(store % zones))
+                 for store in sorted(set(store for zone, group in groups for store in group)))
+
+    item = "I||||||LUSA-200|%s|%s|2016-06-01|2016-06-30|1|%s|%s|%s|%s|USD"
+    for style in rnd.sample(xrange(styles), min(styles_per_adjustment, styles)):
+        zone, group = rnd.choice(groups)
+        locations = [(zone_code(zone), "")] if zone is not None else \
+            [(zone_code(store % zones), store_code(store)) for store in group]
+        price = rnd.randint(5, 300) - 0.01
+        overrides = [(color, price - rnd.randint(1, 5)) for color in xrange(colors_per_style)
+                     if rnd.random() < variant_override_ratio]
+        for location_zone, store in locations:
+            lines.append(item % (location_zone, store, style_code(style), "", "", "%.2f" % price))
+            lines.extend(item % (location_zone, store, style_code(style), "C%02d" % color, variant_code(style, color),
+                                 "%.2f" % override) for color, override in overrides)
+    return lines
+
+
+def write_publish_file(file_name, rnd, adjustments, **knobs):
+    with open(file_name, 'w') as f:
+        for number in xrange(adjustments):
+            f.write("\n".join(adjustment_lines(rnd, number, **knobs)) + "\n")
+
+
+def generate(directory, seed=1, **knobs):
+    """Write JDA_Item_generated.txt, JDA_Store_generated.txt and publish_generated.txt to directory. Knobs
+    not given have DEFAULTS values. Same seed and knobs always give the same files. Returns paths of the
+    item information, store information and publish files."""
+
+    unknown = set(knobs) - set(DEFAULTS)
+    if unknown:
+        raise TypeError("Unknown generator knobs: %s" % ", ".join(sorted(unknown)))
+    values = dict(DEFAULTS, **knobs)
+
+    rnd = random.Random(seed)
+    files = [os.path.join(directory, name) for name in
+             ('JDA_Item_generated.txt', 'JDA_Store_generated.txt', 'publish_generated.txt')]
+    write_item_file(files[0], rnd, **values)
+    write_store_file(files[1], rnd, **values)
+    write_publish_file(files[2], rnd, **values)
+    return files
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        raise SystemExit("Usage: %s <directory> [seed]" % sys.argv[0])
+
+    for name in generate(sys.argv[1], *[int(arg) for arg in sys.argv[2:]]):
+        print name
@@ -0,0 +1,48 @@
+import filecmp
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.controller import ExportController
+from generator import generate
+
+KNOBS = {"styles": 50, "stores": 30, "zones": 3, "adjustments": 2, "styles_per_adjustment": 20,
+         "location_groups": 4, "max_group_stores": 10, "variant_override_ratio": 0.5}
+
+
+class TestGenerator(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate(self, name, seed):
+        directory = os.path.join(self.directory, name)
+        os.mkdir(directory)
+        return generate(directory, seed, **KNOBS)
+
+    def test_same_seed_gives_same_files(self):
+        for f1, f2 in zip(self.generate('a', 1), self.generate('b', 1)):
+            self.assertTrue(filecmp.cmp(f1, f2, shallow=False))
+        self.assertFalse(filecmp.cmp(self.generate('c', 2)[2], os.path.join(self.directory, 'a', 'publish_generated.txt'),
+                                     shallow=False))
+
+    def test_unknown_knob(self):
+        self.assertRaises(TypeError, generate, self.directory, 1, colours=3)
+
+    def test_generated_files_convert(self):
+        item_file, store_file, publish_file = self.generate('data', 1)
+        output_dir = os.path.join(self.directory, 'output')
+        os.mkdir(output_dir)
+
+        c = ExportController()
+        c._item_info_file = item_file
+        c._store_info_file = store_file
+        c.output_dir = output_dir
+        c.process_file(publish_file)
+
+        self.assertEqual(2, len(c.adjustments))
+        self.assertTrue(os.listdir(output_dir))
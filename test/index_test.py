@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.controller import ExportController
+from app.index import ItemIndex, ZoneIndex
+
+
+class TestItemIndex(TestCase):
+
+    def setUp(self):
+        self.item_file = os.path.join('test', 'item_info.txt')
+        self.index = ItemIndex(self.item_file, cache_size=2)
+
+        self.c = ExportController()
+        self.c._item_info_file = self.item_file
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_index_returns_same_variants_as_item_map(self):
+        for style_code, variants in self.c.style_to_variant_map.items():
+            self.assertEqual(self.index.get(style_code), variants)
+
+    def test_filtered_items_are_counted_like_item_map(self):
+        self.c.style_to_variant_map
+        self.assertTrue(self.c.filter_counter)
+        self.assertEqual(self.index.filtered, self.c.filter_counter)
+
+    def test_unknown_style_is_empty(self):
+        self.assertEqual(self.index.get("NO SUCH STYLE"), {})
+
+    def test_least_recently_used_style_is_dropped(self):
+        self.index.get("23002G3")
+        self.index.get("76074 32")
+        self.index.get("23002G3")
+        self.index.get("PRETZEL")
+
+        self.assertEqual(list(self.index._styles), ["23002G3", "PRETZEL"])
+
+    def test_offsets_are_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            ItemIndex(self.item_file, cache_dir).close()
+            index = ItemIndex(self.item_file, cache_dir)
+            self.assertEqual(index.offsets, self.index.offsets)
+            self.assertEqual(index.filtered, self.index.filtered)
+            index.close()
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_row_with_missing_fields_is_rejected(self):
+        directory = tempfile.mkdtemp()
+        try:
+            item_file = os.path.join(directory, 'item_info.txt')
+            with open(self.item_file) as f, open(item_file, 'w') as g:
+                g.write(f.read() + "9999|COLOR|ONLY\n")
+            self.assertRaises(TypeError, ItemIndex, item_file)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_controller_index_lookup(self):
+        self.c.item_lookup = "index"
+        self.assertEqual(self.c.get_color_codes_for_style("23002G3"), self.c.style_to_variant_map["23002G3"])
+
+
+class TestZoneIndex(TestCase):
+
+    def setUp(self):
+        self.store_file = os.path.join('test', 'store_info.txt')
+
+    def test_zones(self):
+        index = ZoneIndex.load(self.store_file)
+        self.assertEqual(index.zones["100"], frozenset(["5012", "5501"]))
+        self.assertEqual(index.store_zones["5012"], ("100",))
+
+    def test_replace_stores_with_zones(self):
+        index = ZoneIndex.load(self.store_file)
+        self.assertEqual(index.replace_stores_with_zones(frozenset(["5012", "5501", "6588"])),
+                         frozenset(["100", "6588"]))
+        self.assertEqual(index.replace_stores_with_zones(frozenset(["5012", "5501", "6588", "6592", "200"])),
+                         frozenset(["100", "300", "200"]))
+
+    def test_partial_zone_is_not_replaced(self):
+        index = ZoneIndex.load(self.store_file)
+        locations = frozenset(["5012", "6588", "100"])
+        self.assertIs(index.replace_stores_with_zones(locations), locations)
+
+    def test_overlapping_zones_are_replaced_in_zone_order(self):
+        index = ZoneIndex({"A": frozenset(["1", "2"]), "B": frozenset(["2", "3"])})
+        first, second = sorted(index.zones, key=index.zone_order.get)
+        rv = index.replace_stores_with_zones(frozenset(["1", "2", "3"]))
+        self.assertEqual(rv, (frozenset(["1", "2", "3"]) - index.zones[first]) | frozenset([first]))
+
+    def test_index_is_loaded_once_per_process(self):
+        self.assertIs(ZoneIndex.load(self.store_file), ZoneIndex.load(self.store_file))
+
+    def test_index_of_changed_file_replaces_old_index(self):
+        import time
+        directory = tempfile.mkdtemp()
+        try:
+            store_file = os.path.join(directory, 'JDA_Store.txt')
+            shutil.copy(self.store_file, store_file)
+            old = ZoneIndex.load(store_file)
+
+            with open(store_file, 'a') as f:
+                f.write("9999|NEW STORE|USA|200|Region 200|220|District 220|999|F||\n")
+            mtime = time.time() + 10
+            os.utime(store_file, (mtime, mtime))
+
+            new = ZoneIndex.load(store_file)
+            self.assertIsNot(old, new)
+            self.assertEqual(frozenset(["9999"]), new.zones["999"])
+            self.assertIs(new, ZoneIndex._loaded[1])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_index_of_differently_named_file_replaces_old_index(self):
+        directory = tempfile.mkdtemp()
+        try:
+            old = ZoneIndex.load(self.store_file)
+            store_file = os.path.join(directory, 'JDA_Store_2.txt')
+            shutil.copy(self.store_file, store_file)
+
+            new = ZoneIndex.load(store_file)
+            self.assertIsNot(old, new)
+            self.assertEqual(new.zones, old.zones)
+            self.assertIs(new, ZoneIndex._loaded[1])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_row_with_missing_fields_is_rejected(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store_file = os.path.join(directory, 'JDA_Store.txt')
+            with open(self.store_file) as f, open(store_file, 'w') as g:
+                g.write(f.read() + "9999|NEW STORE\n")
+            self.assertRaises(TypeError, ZoneIndex.read_zones, store_file)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_adjustments_share_zone_index(self):
+        c = ExportController()
+        c._store_info_file = self.store_file
+        for oid in ("A1", "A2"):
+            c.add_adjustment([oid, "", oid, "", ""])
+            c.add_location_business(["5012", "100", "R"])
+
+        self.assertIs(c.adjustments["A1"].zone_index, c.adjustments["A2"].zone_index)
+
+    def test_zones_are_cached(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            zones = ZoneIndex.read_zones(self.store_file)
+            ZoneIndex._loaded = (None, None)
+            self.assertEqual(ZoneIndex.load(self.store_file, cache_dir).zones, zones)
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'zones.cache')))
+        finally:
+            shutil.rmtree(cache_dir)
@@ -0,0 +1,45 @@
+import logging
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app.logqueue import queued_file_handler
+
+
+class TestQueuedFileHandler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.directory, 'queued.log')
+        self.handler = queued_file_handler(self.log_file, logging.Formatter('%(levelname)s %(message)s'))
+        self.logger = logging.getLogger("logqueue_test")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        shutil.rmtree(self.directory)
+
+    def read_log(self):
+        self.handler.listener.stop()
+        self.handler.listener.start()
+        with open(self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_records_are_written_in_order(self):
+        for i in range(100):
+            self.logger.info("Record %d", i)
+
+        self.assertEqual(["INFO Record %d" % i for i in range(100)], self.read_log())
+
+    def test_message_is_formatted_when_logged(self):
+        fields = ["old"]
+        self.logger.info("Fields: %s", fields)
+        fields[0] = "new"
+
+        self.assertEqual(["INFO Fields: ['old']"], self.read_log())
+
+    def test_handler_is_shared(self):
+        self.assertIs(self.handler, queued_file_handler(self.log_file, logging.Formatter()))
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from app.memory import MemoryProfiler
+from app.report import RunReport
+
+
+class Retained(object):
+    pass
+
+
+class TestMemoryProfiler(TestCase):
+
+    def setUp(self):
+        self.profiler = MemoryProfiler(use_tracemalloc=False)
+        self.report = RunReport(self.profiler)
+
+    def test_retained_objects_are_attributed_to_stage(self):
+        with self.report.stage("allocate"):
+            kept = [Retained() for i in xrange(1000)]
+        with self.report.stage("idle"):
+            pass
+
+        self.assertTrue(self.profiler.stages["allocate"]["sites"]["Retained"] >= 1000)
+        self.assertTrue(self.profiler.stages["idle"]["sites"]["Retained"] < 1000)
+        self.assertEqual(1000, len(kept))
+
+    def test_inner_stage_objects_are_not_counted_for_outer_stage(self):
+        with self.report.stage("outer"):
+            with self.report.stage("inner"):
+                kept = [Retained() for i in xrange(1000)]
+
+        self.assertTrue(self.profiler.stages["inner"]["sites"]["Retained"] >= 1000)
+        self.assertTrue(self.profiler.stages["outer"]["sites"]["Retained"] < 1000)
+        self.assertEqual(1000, len(kept))
+
+    def test_report_includes_memory(self):
+        for i in range(2):
+            with self.report.stage("allocate"):
+                pass
+
+        memory = self.report.as_dict()["memory"]
+        self.assertEqual("rss+gc", memory["method"])
+        self.assertEqual(2, memory["stages"]["allocate"]["count"])
+        self.assertEqual("objects", memory["stages"]["allocate"]["site_unit"])
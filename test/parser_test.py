@@ -0,0 +1,31 @@
+import cStringIO
+from unittest import TestCase
+
+from app.parser import SplitParser, CsvParser, get_parser
+
+LINES = """A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off
+I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|LM 5 PKT 32"|||123.456|USD\r
+LB|5012|100|R   
+
+V|PriceType| |
+I|"quoted"|tab\there|trailing  |  \n"""
+
+
+class TestParsers(TestCase):
+
+    def expected(self, data):
+        return [line.rstrip().split("|") for line in cStringIO.StringIO(data)]
+
+    def test_split_parser_fields(self):
+        self.assertEqual(list(SplitParser().records(cStringIO.StringIO(LINES))), self.expected(LINES))
+
+    def test_csv_parser_fields_match_split_parser(self):
+        self.assertEqual(list(CsvParser().records(cStringIO.StringIO(LINES))), self.expected(LINES))
+
+    def test_empty_file(self):
+        self.assertEqual(list(CsvParser().records(cStringIO.StringIO(""))), [])
+        self.assertEqual(list(SplitParser().records(cStringIO.StringIO(""))), [])
+
+    def test_get_parser(self):
+        self.assertIsInstance(get_parser("csv"), CsvParser)
+        self.assertRaises(ValueError, get_parser, "numpy")
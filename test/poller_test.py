@@ -1,9 +1,16 @@
 from unittest import TestCase
 
+import datetime
 import os
 import sched
+import shutil
+import tempfile
+import threading
+import time
 
+from app.controller import ExportController
 from app.poller import Poller
+from app.watcher import create_watcher
 
 
 class TestFilePoller(TestCase):
@@ -34,3 +41,71 @@ class TestFilePoller(TestCase):
         test_file = os.path.join('test', 'complete.txt')
         p.filename = test_file
         p.run()
+
+    def test_wait_for_change_returns_when_status_file_is_written(self):
+        directory = tempfile.mkdtemp()
+        try:
+            p = Poller()
+            p.filename = os.path.join(directory, 'status.txt')
+            p.sleep_time = 5
+            p.start_time = (datetime.datetime.now() - datetime.timedelta(hours=1)).time()
+            p.duration = 2
+            p.watcher = create_watcher(p.filename, 'auto')
+
+            def finish():
+                with open(p.filename, 'w') as f:
+                    f.write("finish\n")
+            threading.Timer(0.05, finish).start()
+
+            start = time.time()
+            p.wait_for_change()
+            self.assertTrue(time.time() - start < 1)
+            p.watcher.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_in_process_conversion(self):
+        directory = tempfile.mkdtemp()
+        try:
+            publish_file = os.path.join(directory, 'publish_1.txt')
+            with open(publish_file, 'w') as f:
+                f.write("A|A25E3EE9AFA248A79DF07D2565410784||Back to school 10% off||Promotion % Off\n"
+                        "S|2016-06-01|2016-06-30|||1|1|1|1|1|1|1\n"
+                        "V|PriceCode|2|\nV|EventType|A|\nV|ReasonCode|A|\nV|Country|USA|\n"
+                        "V|DataType||\nV|BasedOn|2|\nV|OverrideAll||\n"
+                        "LB|5012|100|R\n"
+                        "I||||||LUSA-100|100|5012|2016-06-01|2016-06-30|1|76074 32|||123.456|USD\n")
+
+            p = Poller()
+            p.conversion = 'in_process'
+            p.publish_files = os.path.join(directory, 'publish_*.txt')
+            p._controller = ExportController()
+            p._controller._item_info_file = os.path.join('test', 'item_info.txt')
+            p._controller._store_info_file = os.path.join('test', 'store_info.txt')
+            p._controller.output_dir = directory
+
+            self.assertIsNotNone(p.run_conversion())
+            self.assertIsNotNone(p.run_conversion())  # warm controller converts the next upload
+            self.assertEqual(2, len(os.listdir(directory)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_invalid_conversion_is_rejected(self):
+        import ConfigParser
+        directory = tempfile.mkdtemp()
+        try:
+            cfg = ConfigParser.ConfigParser()
+            cfg.read(os.path.join('test', 'Guess.properties'))
+            cfg.set("POLLER", "conversion", "inprocess")
+            property_file = os.path.join(directory, 'Guess.properties')
+            with open(property_file, 'w') as f:
+                cfg.write(f)
+
+            self.assertRaises(SystemExit, Poller, property_file)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_in_process_conversion_without_publish_files(self):
+        p = Poller()
+        p.publish_files = os.path.join('no_such_dir', 'publish_*.txt')
+        self.assertIsNone(p.run_conversion())
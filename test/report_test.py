@@ -0,0 +1,49 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from app.report import RunReport
+
+
+class TestRunReport(TestCase):
+
+    def test_inner_stage_time_is_not_counted_for_outer_stage(self):
+        r = RunReport()
+        with r.stage("outer"):
+            with r.stage("inner"):
+                time.sleep(0.05)
+
+        self.assertTrue(r.stages["inner"] >= 0.04)
+        self.assertTrue(r.stages["outer"] < 0.04)
+        self.assertEqual(1, r.stage_counts["outer"])
+
+    def test_merge(self):
+        r1, r2 = RunReport(), RunReport()
+        for r in (r1, r2):
+            with r.stage("write_files"):
+                pass
+            r.count("events", 2)
+        r2.count("bytes_written", 100)
+
+        r1.merge(r2)
+        self.assertEqual(2, r1.stage_counts["write_files"])
+        self.assertEqual({"events": 4, "bytes_written": 100}, r1.counters)
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        try:
+            r = RunReport()
+            r.count("records.I", 10)
+            report_file = os.path.join(directory, 'report.json')
+            r.write(report_file, publish_file="publish.txt")
+
+            with open(report_file) as f:
+                report = json.load(f)
+            self.assertEqual("publish.txt", report["publish_file"])
+            self.assertEqual({"records.I": 10}, report["counters"])
+            self.assertEqual(["report.json"], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+
+from app.watcher import InotifyWatcher, PollingWatcher, create_watcher
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is available on Linux only")
+class TestInotifyWatcher(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.status_file = os.path.join(self.directory, 'status.txt')
+        self.watcher = InotifyWatcher(self.status_file)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, file_name, delay=0.0):
+        def write():
+            time.sleep(delay)
+            with open(file_name, 'w') as f:
+                f.write("finish\n")
+        t = threading.Thread(target=write)
+        t.start()
+        return t
+
+    def test_wait_returns_when_file_is_written(self):
+        t = self.write(self.status_file, 0.05)
+        start = time.time()
+        self.assertTrue(self.watcher.wait(5))
+        self.assertTrue(time.time() - start < 1)
+        t.join()
+
+    def test_file_moved_into_place_is_seen(self):
+        temp_file = os.path.join(self.directory, 'status.tmp')
+        with open(temp_file, 'w') as f:
+            f.write("finish\n")
+        os.rename(temp_file, self.status_file)
+        self.assertTrue(self.watcher.wait(1))
+
+    def test_other_files_are_ignored(self):
+        self.write(os.path.join(self.directory, 'other.txt')).join()
+        self.assertFalse(self.watcher.wait(0.1))
+
+    def test_wait_times_out_without_changes(self):
+        self.assertFalse(self.watcher.wait(0.05))
+
+
+class TestCreateWatcher(TestCase):
+
+    def test_missing_directory_falls_back_to_polling(self):
+        w = create_watcher(os.path.join('no_such_dir', 'status.txt'), 'auto')
+        self.assertIsInstance(w, PollingWatcher)
+
+    def test_poll_mode(self):
+        w = create_watcher(os.path.join('test', 'complete.txt'), 'poll')
+        self.assertIsInstance(w, PollingWatcher)
+        self.assertFalse(w.wait(0))
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, create_watcher, os.path.join('test', 'complete.txt'), 'fsevents')
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from app.adjustment import PricingEvent, ItemKey, format_rows
+from app.writer import EventWriter
+
+HEADERS = [["H", "Description"], ["H", "Writer test"]]
+
+
+class TestEventWriter(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.items = [ItemKey("", "", "1", "23002G3", "NC", "676099", "1200", "USD")]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def create_events(self, count):
+        return [PricingEvent("event_%d" % i, HEADERS, [str(5000 + i)], self.items, self.output_dir)
+                for i in range(count)]
+
+    def test_events_are_written(self):
+        writer = EventWriter(4)
+        [writer.write(e) for e in self.create_events(20)]
+        writer.close()
+
+        self.assertEqual(sorted(os.listdir(self.output_dir)), sorted("event_%d.txt" % i for i in range(20)))
+
+    def test_written_file_equals_sequential_export(self):
+        e = self.create_events(1)[0]
+        e.export_tab_delimited()
+        with open("%s.txt" % e.filename, 'rb') as f:
+            expected = f.read()
+        os.remove("%s.txt" % e.filename)
+
+        writer = EventWriter(2)
+        writer.write(e)
+        writer.close()
+        with open("%s.txt" % e.filename, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_write_error_is_raised_on_close(self):
+        e = self.create_events(1)[0]
+        e.basedir = os.path.join(self.output_dir, "no_such_dir")
+
+        writer = EventWriter(2)
+        writer.write(e)
+        self.assertRaises(IOError, writer.close)
+
+
+class TestAtomicExport(TestCase):
+
+    def test_existing_file_is_replaced_and_no_temporary_file_remains(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            e = PricingEvent("event", HEADERS, ["5012"], [], output_dir)
+            with open("%s.txt" % e.filename, 'w') as f:
+                f.write("old content")
+
+            e.export_tab_delimited()
+            self.assertEqual(os.listdir(output_dir), ["event.txt"])
+            with open("%s.txt" % e.filename) as f:
+                self.assertTrue(f.read().startswith("H\tDescription"))
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_concurrent_writers_of_same_event_do_not_share_temporary_file(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            items = [ItemKey("", "", "1", "23002G3", "NC", str(n), "1200", "USD") for n in range(20000)]
+            events = [PricingEvent("Same name_1_1", HEADERS, [location], items, output_dir)
+                      for location in ("5012", "5501")]
+            errors = []
+
+            def export(e):
+                try:
+                    for i in range(10):
+                        e.export_tab_delimited()
+                except Exception, ex:
+                    errors.append(ex)
+
+            threads = [threading.Thread(target=export, args=(e,)) for e in events]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(output_dir), ["Same name_1_1.txt"])
+            with open("%s.txt" % events[0].filename, 'rb') as f:
+                self.assertIn(f.read(), [format_rows(e.get_export_rows()) for e in events])
+        finally:
+            shutil.rmtree(output_dir)